@@ -27,7 +27,6 @@
 import sys
 import time
 import os
-import string
 import re
 import platform
 import shutil
@@ -208,28 +207,26 @@ sysvals = SystemValues()
 # Description:
 #	 The primary container for test data.
 class Data(aslib.Data):
-	dmesg = {}  # root data structure
-	start = 0.0 # test start
-	end = 0.0   # test end
-	dmesgtext = []   # dmesg text file in memory
-	testnumber = 0
-	idstr = ''
-	html_device_id = 0
-	valid = False
-	tUserMode = 0.0
-	boottime = ''
-	phases = ['kernel', 'user']
-	do_one_initcall = False
 	def __init__(self, num):
+		self.start = 0.0 # test start
+		self.end = 0.0   # test end
 		self.testnumber = num
 		self.idstr = 'a'
-		self.dmesgtext = []
-		self.dmesg = {
+		self.html_device_id = 0
+		self.valid = False
+		self.tUserMode = 0.0
+		self.boottime = ''
+		self.phases = ['kernel', 'user']
+		self.do_one_initcall = False
+		self.dmesgtext = []   # dmesg text file in memory
+		self.dmesg = {  # root data structure
 			'kernel': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0,
 				'order': 0, 'color': 'linear-gradient(to bottom, #fff, #bcf)'},
 			'user': {'list': dict(), 'start': -1.0, 'end': -1.0, 'row': 0,
 				'order': 1, 'color': '#fff'}
 		}
+	def sortedPhases(self):
+		return self.phases
 	def deviceTopology(self):
 		return ''
 	def newAction(self, phase, name, pid, start, end, ret, ulen):
@@ -463,12 +460,15 @@ def retrieveLogs():
 	sysvals.systemInfo(aslib.dmidecode(sysvals.mempath))
 	sysvals.initTestOutput('boot')
 	sysvals.writeDatafileHeader(sysvals.dmesgfile)
-	call('dmesg >> '+sysvals.dmesgfile, shell=True)
+	with open(sysvals.dmesgfile, 'a') as fp:
+		call('dmesg', stdout=fp)
 	if not sysvals.useftrace:
 		return
 	# get ftrace
 	sysvals.writeDatafileHeader(sysvals.ftracefile)
-	call('cat '+sysvals.tpath+'trace >> '+sysvals.ftracefile, shell=True)
+	with open(sysvals.tpath+'trace', 'r') as fp, \
+		open(sysvals.ftracefile, 'a') as op:
+		shutil.copyfileobj(fp, op, 1<<20)
 
 # Function: colorForName
 # Description:
@@ -537,7 +537,7 @@ def createBootGraph(data):
 		return False
 	user_mode = '%.0f'%(data.tUserMode*1000)
 	last_init = '%.0f'%(tTotal*1000)
-	devtl.html += html_timetotal.format(user_mode, last_init)
+	devtl.html.append(html_timetotal.format(user_mode, last_init))
 
 	# determine the maximum number of rows we need to draw
 	devlist = []
@@ -551,15 +551,15 @@ def createBootGraph(data):
 
 	# draw the timeline background
 	devtl.createZoomBox()
-	devtl.html += devtl.html_tblock.format('boot', '0', '100', devtl.scaleH)
+	devtl.html.append(devtl.html_tblock.format('boot', '0', '100', devtl.scaleH))
 	for p in data.phases:
 		phase = data.dmesg[p]
 		length = phase['end']-phase['start']
 		left = '%.3f' % (((phase['start']-t0)*100.0)/tTotal)
 		width = '%.3f' % ((length*100.0)/tTotal)
-		devtl.html += devtl.html_phase.format(left, width, \
+		devtl.html.append(devtl.html_phase.format(left, width, \
 			'%.3f'%devtl.scaleH, '%.3f'%devtl.bodyH, \
-			phase['color'], '')
+			phase['color'], ''))
 
 	# draw the device timeline
 	num = 0
@@ -578,9 +578,9 @@ def createBootGraph(data):
 			left = '%.6f' % (((dev['start']-t0)*100)/tTotal)
 			width = '%.6f' % (((dev['end']-dev['start'])*100)/tTotal)
 			length = ' (%0.3f ms) ' % ((dev['end']-dev['start'])*1000)
-			devtl.html += devtl.html_device.format(dev['id'],
+			devtl.html.append(devtl.html_device.format(dev['id'],
 				devname+length+phase+'_mode', left, top, '%.3f'%height,
-				width, devname, ' '+cls, '')
+				width, devname, ' '+cls, ''))
 			rowtop = devtl.phaseRowTop(0, phase, dev['row'])
 			height = '%.6f' % (devtl.rowH / 2)
 			top = '%.6f' % (rowtop + devtl.scaleH + (devtl.rowH / 2))
@@ -594,8 +594,8 @@ def createBootGraph(data):
 					left = '%f' % (((l.time-t0)*100)/tTotal)
 					width = '%f' % (l.length*100/tTotal)
 					title = '%s (%0.3fms)' % (l.name, l.length * 1000.0)
-					devtl.html += html_srccall.format(l.name, left,
-						top, height, width, title, 'x%d'%num)
+					devtl.html.append(html_srccall.format(l.name, left,
+						top, height, width, title, 'x%d'%num))
 					num += 1
 				continue
 			if('ftraces' not in dev):
@@ -606,28 +606,29 @@ def createBootGraph(data):
 				cglen = (cg.end - cg.start) * 1000.0
 				title = '%s (%0.3fms)' % (cg.name, cglen)
 				cg.id = 'x%d' % num
-				devtl.html += html_srccall.format(cg.name, left,
-					top, height, width, title, dev['id']+cg.id)
+				devtl.html.append(html_srccall.format(cg.name, left,
+					top, height, width, title, dev['id']+cg.id))
 				num += 1
 
 	# draw the time scale, try to make the number of labels readable
 	devtl.createTimeScale(t0, tMax, tTotal, 'boot')
-	devtl.html += '</div>\n'
+	devtl.html.append('</div>\n')
 
 	# timeline is finished
-	devtl.html += '</div>\n</div>\n'
+	devtl.html.append('</div>\n</div>\n')
 
 	# draw a legend which describes the phases by color
-	devtl.html += '<div class="legend">\n'
+	devtl.html.append('<div class="legend">\n')
 	pdelta = 20.0
 	pmargin = 36.0
 	for phase in data.phases:
 		order = '%.2f' % ((data.dmesg[phase]['order'] * pdelta) + pmargin)
-		devtl.html += devtl.html_legend.format(order, \
-			data.dmesg[phase]['color'], phase+'_mode', phase[0])
-	devtl.html += '</div>\n'
+		devtl.html.append(devtl.html_legend.format(order, \
+			data.dmesg[phase]['color'], phase+'_mode', phase[0]))
+	devtl.html.append('</div>\n')
 
-	hf = open(sysvals.htmlfile, 'w')
+	# the callgraphs are many small writes, give them a large buffer
+	hf = open(sysvals.htmlfile, 'w', buffering=1<<19)
 
 	# add the css
 	extra = '\
@@ -650,7 +651,7 @@ def createBootGraph(data):
 	aslib.addCSS(hf, sysvals, 1, False, extra)
 
 	# write the device timeline
-	hf.write(devtl.html)
+	hf.write(''.join(devtl.html))
 
 	# add boot specific html
 	statinfo = 'var devstats = {\n'
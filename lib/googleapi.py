@@ -23,13 +23,50 @@ import os
 import sys
 import time
 import fcntl
+import tempfile
 import os.path as op
 
-httplib2 = discovery = ofile = oclient = otools = None
+httplib2 = discovery = ofile = oclient = otools = jsonmodel = None
 gdrive = 0
 gsheet = 0
 lockfile = '/tmp/googleapi.lock'
 gdriveids = dict()
+gdriveroot = ''
+gcreds = None
+
+class DiscoveryCache:
+	# on-disk cache of the api discovery documents so each run
+	# doesn't download them again, used by discovery.build
+	def __init__(self, maxage=86400):
+		self.dir = op.expanduser('~/.cache/pm-graph')
+		self.maxage = maxage
+	def filename(self, url):
+		return op.join(self.dir, ''.join(c if c.isalnum() else '_' for c in url))
+	def get(self, url):
+		file = self.filename(url)
+		try:
+			if time.time() - op.getmtime(file) > self.maxage:
+				return None
+			with open(file) as fp:
+				return fp.read()
+		except:
+			return None
+	def set(self, url, content):
+		# other processes read the cache too, so only rename in whole files
+		tmp = None
+		try:
+			os.makedirs(self.dir, exist_ok=True)
+			with tempfile.NamedTemporaryFile('w', dir=self.dir, delete=False) as fp:
+				tmp = fp.name
+				fp.write(content)
+			os.replace(tmp, self.filename(url))
+		except OSError as e:
+			print('WARNING: could not cache %s: %s' % (url, e))
+			if tmp and op.exists(tmp):
+				try:
+					os.remove(tmp)
+				except OSError:
+					pass
 
 def mutex_lock(wait=1):
 	global lockfile
@@ -65,7 +102,7 @@ def getfile(file):
 	return ''
 
 def loadGoogleLibraries():
-	global httplib2, discovery, ofile, oclient, otools
+	global httplib2, discovery, ofile, oclient, otools, jsonmodel
 	try:
 		import httplib2
 	except:
@@ -87,6 +124,19 @@ def loadGoogleLibraries():
 		print('Missing libraries, please run this command:')
 		print('sudo pip3 install --upgrade oauth2client')
 		sys.exit(1)
+	# orjson is optional, it just speeds up encoding the request bodies
+	try:
+		import orjson
+		from apiclient.model import JsonModel
+		class OrjsonModel(JsonModel):
+			def serialize(self, body_value):
+				if isinstance(body_value, dict) and 'data' not in body_value and \
+					self._data_wrapper:
+					body_value = {'data': body_value}
+				return orjson.dumps(body_value).decode()
+		jsonmodel = OrjsonModel()
+	except:
+		jsonmodel = None
 
 def setupGoogleAPIs():
 	global gsheet, gdrive
@@ -123,26 +173,35 @@ def setupGoogleAPIs():
 		print('Your credentials.json file appears valid, please delete it to re-run setup')
 	return 0
 
-def initGoogleAPIs(force=False):
-	global gsheet, gdrive
+def getCredentials():
+	global gcreds
 
-	# don't reinit unless forced to
-	if not force and gdrive and gsheet:
-		return
-
-	loadGoogleLibraries()
-	SCOPES = 'https://www.googleapis.com/auth/spreadsheets https://www.googleapis.com/auth/drive'
+	# the credentials file is only found and parsed once
+	if gcreds and not gcreds.invalid:
+		return gcreds
 	cf = getfile('credentials.json')
 	if not cf:
 		print('ERROR: no credentials.json file found (please run -setup)')
 		sys.exit(1)
 	store = ofile.Storage(cf)
-	creds = store.get()
-	if not creds or creds.invalid:
+	gcreds = store.get()
+	if not gcreds or gcreds.invalid:
 		print('ERROR: failed to get google api credentials (please run -setup)')
 		sys.exit(1)
-	gdrive = google_api_command('initdrive', creds)
-	gsheet = google_api_command('initsheet', creds)
+	return gcreds
+
+def initGoogleAPIs(force=False):
+	global gsheet, gdrive
+
+	# don't reinit unless forced to
+	if not force and gdrive and gsheet:
+		return
+
+	loadGoogleLibraries()
+	# both services share one authorized http connection
+	http = getCredentials().authorize(httplib2.Http())
+	gdrive = google_api_command('initdrive', http)
+	gsheet = google_api_command('initsheet', http)
 
 def google_api_command(cmd, arg1=None, arg2=None, arg3=None, retry=0):
 	global gsheet, gdrive
@@ -163,6 +222,8 @@ def google_api_command(cmd, arg1=None, arg2=None, arg3=None, retry=0):
 			if 'nextPageToken' in res:
 				files += google_api_command('list', arg1, arg2, res['nextPageToken'])
 			return files
+		elif cmd == 'rootid':
+			return gdrive.files().get(fileId='root', fields='id').execute().get('id')
 		elif cmd == 'get':
 			return gdrive.files().get(fileId=arg1, fields='parents').execute()
 		elif cmd == 'rename':
@@ -171,9 +232,33 @@ def google_api_command(cmd, arg1=None, arg2=None, arg3=None, retry=0):
 			return gdrive.files().create(body=arg1, fields='id').execute()
 		elif cmd == 'delete':
 			return gdrive.files().delete(fileId=arg1).execute()
+		elif cmd == 'deletelist':
+			# arg1 is one batch (at most 100 ids), errors only reach a callback
+			failed = []
+			def deleted(rid, response, exception):
+				if exception is None:
+					return
+				# on a retry a 404 means an earlier attempt already got it
+				status = getattr(getattr(exception, 'resp', None), 'status', 0)
+				if retry and status == 404:
+					return
+				failed.append((rid, exception))
+			batch = gdrive.new_batch_http_request(callback=deleted)
+			for i, id in enumerate(arg1):
+				batch.add(gdrive.files().delete(fileId=id), request_id=str(i))
+			batch.execute()
+			if failed:
+				# shrink the list in place so the retry only redoes the failures
+				arg1[:] = [arg1[int(rid)] for rid, e in failed]
+				raise failed[0][1]
+			return True
 		elif cmd == 'move':
-			file = gdrive.files().get(fileId=arg1, fields='parents').execute()
-			oldpar = ','.join(file.get('parents'))
+			# arg3 is the current parent if the caller knows it
+			if arg3:
+				oldpar = arg3
+			else:
+				file = gdrive.files().get(fileId=arg1, fields='parents').execute()
+				oldpar = ','.join(file.get('parents'))
 			return gdrive.files().update(fileId=arg1, addParents=arg2, removeParents=oldpar, fields='id, parents').execute()
 		elif cmd == 'upload':
 			return gdrive.files().create(body=arg1, media_body=arg2, fields='id').execute()
@@ -182,9 +267,11 @@ def google_api_command(cmd, arg1=None, arg2=None, arg3=None, retry=0):
 		elif cmd == 'formatsheet':
 			return gsheet.spreadsheets().batchUpdate(spreadsheetId=arg1, body=arg2).execute()
 		elif cmd == 'initdrive':
-			return discovery.build('drive', 'v3', http=arg1.authorize(httplib2.Http()))
+			return discovery.build('drive', 'v3', http=arg1, cache=DiscoveryCache(),
+				model=jsonmodel)
 		elif cmd == 'initsheet':
-			return discovery.build('sheets', 'v4', http=arg1.authorize(httplib2.Http()))
+			return discovery.build('sheets', 'v4', http=arg1, cache=DiscoveryCache(),
+				model=jsonmodel)
 	except Exception as e:
 		if retry >= 10:
 			print('ERROR: %s\n' % str(e))
@@ -226,24 +313,49 @@ def gdrive_find(gpath):
 		return out[0]['id']
 	return ''
 
+def gdrive_folders(names):
+	fmime = 'application/vnd.google-apps.folder'
+	# fetch every folder with one of these names in a single query
+	nlist = []
+	for name in names:
+		if name not in nlist:
+			nlist.append(name)
+	query = 'trashed = false and mimeType = \'%s\' and (%s)' % \
+		(fmime, ' or '.join('name = \'%s\'' % n for n in nlist))
+	folders = dict()
+	for file in google_api_command('list', query, 'id,name,parents'):
+		for parent in file.get('parents', []):
+			if (parent, file['name']) not in folders:
+				folders[(parent, file['name'])] = file['id']
+	return folders
+
 def gdrive_mkdir(dir='', readonly=False):
-	global gdriveids
+	global gdriveids, gdriveroot
 	fmime, pid, cpath = 'application/vnd.google-apps.folder', 'root', ''
 	if not dir:
 		return pid
+	# a fully cached path needs neither the lock nor any queries
+	if dir in gdriveids and gdriveids[dir]:
+		return gdriveids[dir]
 	if not readonly:
 		lock = mutex_lock(60)
-	for subdir in dir.split('/'):
+	parts, folders = dir.split('/'), None
+	for i, subdir in enumerate(parts):
 		cpath = op.join(cpath, subdir) if cpath else subdir
 		if cpath in gdriveids and gdriveids[cpath]:
 			pid = gdriveids[cpath]
 			continue
-		# if this subdir exists, move on
-		query = 'trashed = false and mimeType = \'%s\' and \'%s\' in parents and name = \'%s\'' % \
-			(fmime, pid, subdir)
-		out = google_api_command('list', query)
-		if len(out) > 0 and 'id' in out[0]:
-			gdriveids[cpath] = pid = out[0]['id']
+		# look up the rest of the path at once, then walk it locally
+		if folders is None:
+			folders = gdrive_folders(parts[i:])
+		# parents come back as real ids, so resolve the root alias once
+		if pid == 'root':
+			if not gdriveroot:
+				gdriveroot = google_api_command('rootid')
+			pid = gdriveroot
+		key = (pid, subdir)
+		if key in folders:
+			gdriveids[cpath] = pid = folders[key]
 			continue
 		# create the subdir
 		if readonly:
@@ -263,9 +375,13 @@ def gdrive_get(folder, name):
 
 def gdrive_delete(folder, name):
 	global gdriveids
+	ids = []
 	for item in gdrive_get(folder, name):
 		print('deleting duplicate - %s (%s)' % (item['name'], item['id']))
-		google_api_command('delete', item['id'])
+		ids.append(item['id'])
+	# drive batches hold at most 100 calls each, retried per chunk
+	for i in range(0, len(ids), 100):
+		google_api_command('deletelist', ids[i:i+100])
 	gpath = os.path.join(folder, name)
 	del gdriveids[gpath]
 
@@ -355,7 +471,7 @@ def gdrive_upload(local, remote):
 	if dir and dir not in ['.', '/']:
 		fid = gdrive_mkdir(dir)
 		if fid:
-			file = google_api_command('move', res['id'], fid)
+			file = google_api_command('move', res['id'], fid, 'root')
 	print('https://drive.google.com/open?id=%s' % res['id'])
 	return True
 
@@ -374,7 +490,7 @@ def gdrive_sheet(local, remote):
 	if dir and dir not in ['.', '/']:
 		fid = gdrive_mkdir(dir)
 		if fid:
-			file = google_api_command('move', res['id'], fid)
+			file = google_api_command('move', res['id'], fid, 'root')
 	print('https://drive.google.com/open?id=%s' % res['id'])
 	return True
 
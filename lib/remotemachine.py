@@ -23,15 +23,23 @@ import os
 import sys
 import re
 import time
-from subprocess import call, Popen, PIPE
+import shutil
+import tempfile
+import threading
+from subprocess import call, Popen, PIPE, DEVNULL
 from lib.parallel import AsyncProcess
 
+# checkhost can run in many threads at once, and ssh-keygen -R rewrites
+# known_hosts, so only let one thread do that at a time
+keygenlock = threading.Lock()
+
 class RemoteMachine:
 	wdev = ''
 	wmac = ''
 	wip = ''
 	wap = ''
 	status = False
+	ctlpath = ''
 	def __init__(self, user, host, addr, reset=None, reserve=None, release=None):
 		self.user = user
 		self.host = host
@@ -66,7 +74,8 @@ class RemoteMachine:
 				if os.environ.get('USER'):
 					cmd = 'ssh-keygen -f "/home/%s/.ssh/known_hosts" -R "%s"' % \
 						(os.environ.get('USER'), self.addr)
-					call(cmd, shell=True)
+					with keygenlock:
+						call(cmd, shell=True)
 				i += 1
 			else:
 				break
@@ -92,12 +101,38 @@ class RemoteMachine:
 	def setupordie(self):
 		if not self.setup():
 			sys.exit(1)
+	def sshmaster(self):
+		# open a master connection that later ssh/scp calls share, it
+		# exits by itself after sitting idle if we never get to stop it
+		if self.ctlpath:
+			return True
+		# the socket goes in a private dir so no one else can plant it
+		ctldir = tempfile.mkdtemp(prefix='pmgraph-ssh-')
+		ctlpath = os.path.join(ctldir, 'master')
+		cmd = 'ssh -M -N -f -oBatchMode=yes -oStrictHostKeyChecking=no '+\
+			'-oConnectTimeout=5 -oControlPersist=600 -oControlPath=%s %s@%s' % \
+			(ctlpath, self.user, self.addr)
+		res = call(cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL)
+		if res != 0 or not os.path.exists(ctlpath):
+			shutil.rmtree(ctldir, ignore_errors=True)
+			return False
+		self.ctlpath = ctlpath
+		return True
+	def sshmaster_stop(self):
+		if not self.ctlpath:
+			return
+		cmd = 'ssh -O exit -oControlPath=%s %s@%s' % (self.ctlpath, self.user, self.addr)
+		call(cmd, shell=True, stdout=DEVNULL, stderr=DEVNULL)
+		shutil.rmtree(os.path.dirname(self.ctlpath), ignore_errors=True)
+		self.ctlpath = ''
+	def sshopts(self):
+		return '-oControlPath=%s ' % self.ctlpath if self.ctlpath else ''
 	def sshproc(self, cmd, timeout=60, userinput=False, ping=True):
 		if userinput:
-			cmdfmt = 'ssh %s@%s -oStrictHostKeyChecking=no "{0}"'
+			cmdfmt = 'ssh %s%s@%s -oStrictHostKeyChecking=no "{0}"'
 		else:
-			cmdfmt = 'nohup ssh -oBatchMode=yes -oStrictHostKeyChecking=no %s@%s "{0}"'
-		cmdline = (cmdfmt % (self.user, self.addr)).format(cmd)
+			cmdfmt = 'nohup ssh -oBatchMode=yes -oStrictHostKeyChecking=no %s%s@%s "{0}"'
+		cmdline = (cmdfmt % (self.sshopts(), self.user, self.addr)).format(cmd)
 		if ping:
 			return AsyncProcess(cmdline, timeout, self.addr)
 		return AsyncProcess(cmdline, timeout)
@@ -115,7 +150,10 @@ class RemoteMachine:
 				return('SSH TIMEOUT: %s' % cmd)
 		return out
 	def scpfile(self, file, dir):
-		res = call('scp %s %s@%s:%s/' % (file, self.user, self.addr, dir), shell=True)
+		return self.scpfiles([file], dir)
+	def scpfiles(self, files, dir):
+		res = call('scp %s%s %s@%s:%s/' % (self.sshopts(), ' '.join(files),
+			self.user, self.addr, dir), shell=True)
 		return res == 0
 	def openshell(self):
 		call('ssh -X %s@%s' % (self.user, self.addr), shell=True)
@@ -165,13 +203,12 @@ class RemoteMachine:
 			return ''
 		out = ''
 		if wowlan:
-			out += self.sshcmd('sudo iw phy0 wowlan enable magic-packet disconnect', 30)
-			out += self.sshcmd('sudo iw phy0 wowlan show', 30)
+			out += self.sshcmd('sudo iw phy0 wowlan enable magic-packet disconnect ; '\
+				'sudo iw phy0 wowlan show', 60)
 		return out
 	def bootsetup(self):
-		self.sshcmd('sudo systemctl stop apt-daily-upgrade', 30)
-		self.sshcmd('sudo systemctl stop apt-daily', 30)
-		self.sshcmd('sudo systemctl stop upower', 30)
+		self.sshcmd('sudo systemctl stop apt-daily-upgrade ; '\
+			'sudo systemctl stop apt-daily ; sudo systemctl stop upower', 90)
 	def bioscheck(self, wowlan=False):
 		print('MACHINE: %s' % self.host)
 		out = self.sshcmd('sudo sleepgraph -sysinfo', 10, False)
@@ -350,5 +387,6 @@ class RemoteMachine:
 		self.wifisetup(True)
 		print('Machine is back: %s' % self.host)
 	def die(self):
+		self.sshmaster_stop()
 		self.release_machine()
 		sys.exit(1)
@@ -58,13 +58,16 @@ import re
 import platform
 import signal
 import codecs
+import io
 from datetime import datetime, timedelta
 import struct
 import configparser
 import gzip
+import shutil
 from threading import Thread
 from subprocess import call, Popen, PIPE
 import base64
+from bisect import bisect_left
 
 def pprint(msg):
 	print(msg)
@@ -489,7 +492,7 @@ class SystemValues:
 	def setCallgraphBlacklist(self, file):
 		self.cgblacklist = self.listFromFile(file)
 	def rtcWakeAlarmOn(self):
-		call('echo 0 > '+self.rtcpath+'/wakealarm', shell=True)
+		self.setVal('0', self.rtcpath+'/wakealarm')
 		nowtime = open(self.rtcpath+'/since_epoch', 'r').read().strip()
 		if nowtime:
 			nowtime = int(nowtime)
@@ -497,9 +500,9 @@ class SystemValues:
 			# if hardware time fails, use the software time
 			nowtime = int(datetime.now().strftime('%s'))
 		alarm = nowtime + self.rtcwaketime
-		call('echo %d > %s/wakealarm' % (alarm, self.rtcpath), shell=True)
+		self.setVal('%d' % alarm, self.rtcpath+'/wakealarm')
 	def rtcWakeAlarmOff(self):
-		call('echo 0 > %s/wakealarm' % self.rtcpath, shell=True)
+		self.setVal('0', self.rtcpath+'/wakealarm')
 	def initdmesg(self):
 		# get the latest time stamp from the dmesg log
 		lines = Popen('dmesg', stdout=PIPE).stdout.readlines()
@@ -548,7 +551,8 @@ class SystemValues:
 	def getFtraceFilterFunctions(self, current):
 		self.rootCheck(True)
 		if not current:
-			call('cat '+self.tpath+'available_filter_functions', shell=True)
+			with open(self.tpath+'available_filter_functions', 'r') as fp:
+				shutil.copyfileobj(fp, sys.stdout)
 			return
 		master = self.listFromFile(self.tpath+'available_filter_functions')
 		for i in sorted(self.tracefuncs):
@@ -1436,8 +1440,13 @@ class Data:
 		self.tLow = []        # time spent in low-level suspends (standby/freeze)
 		self.devpids = []
 		self.devicegroups = 0
+		self.devindex = dict()
+		self.phaseranges = []
+		self.phasecache = []  # sorted phase names, reset when phases change
 	def sortedPhases(self):
-		return sorted(self.dmesg, key=lambda k:self.dmesg[k]['order'])
+		if not self.phasecache:
+			self.phasecache = sorted(self.dmesg, key=lambda k:self.dmesg[k]['order'])
+		return self.phasecache
 	def initDevicegroups(self):
 		# called when phases are all finished being added
 		for phase in sorted(self.dmesg.keys()):
@@ -1445,6 +1454,7 @@ class Data:
 				p = phase.split('*')
 				pnew = '%s%d' % (p[0], len(p))
 				self.dmesg[pnew] = self.dmesg.pop(phase)
+		self.phasecache = []
 		self.devicegroups = []
 		for phase in self.sortedPhases():
 			self.devicegroups.append([phase])
@@ -1782,6 +1792,7 @@ class Data:
 				'row': 0, 'color': color, 'order': count}
 			self.dmesg[phase]['start'] = ktime
 			self.currphase = phase
+			self.phasecache = []
 		else:
 			# phase end without a start
 			if phase not in self.currphase:
@@ -1797,6 +1808,35 @@ class Data:
 	def sortedDevices(self, phase):
 		list = self.dmesg[phase]['list']
 		return sorted(list, key=lambda k:list[k]['start'])
+	def initDeviceIndex(self):
+		# snapshot the phase ranges and index the devices in each
+		# phase by pid, sorted by start time
+		self.phaseranges = [(self.dmesg[p]['start'], self.dmesg[p]['end'], p)
+			for p in self.sortedPhases()]
+		self.devindex = dict()
+		for phase in self.dmesg:
+			index = dict()
+			list = self.dmesg[phase]['list']
+			for devname in self.sortedDevices(phase):
+				pid = list[devname]['pid']
+				if pid not in index:
+					index[pid] = ([], [])
+				index[pid][0].append(list[devname]['start'])
+				index[pid][1].append(devname)
+			self.devindex[phase] = index
+	def devicesInRange(self, phase, pid, start, end):
+		# devices from pid which lie entirely inside start-end, by start time
+		if phase not in self.devindex or pid not in self.devindex[phase]:
+			return []
+		starts, names = self.devindex[phase][pid]
+		list = self.dmesg[phase]['list']
+		devlist = []
+		for i in range(bisect_left(starts, start), len(starts)):
+			if starts[i] > end:
+				break
+			if end >= list[names[i]]['end']:
+				devlist.append(names[i])
+		return devlist
 	def fixupInitcalls(self, phase):
 		# if any calls never returned, clip them at system resume end
 		phaselist = self.dmesg[phase]['list']
@@ -2129,22 +2169,45 @@ class Data:
 		if 'resume_complete' in dm:
 			dm['resume_complete']['end'] = time
 	def initcall_debug_call(self, line, quick=False):
-		m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) .* (?P<f>.*)\: '+\
-			'calling .* @ (?P<n>.*), parent: (?P<p>.*)', line)
-		if not m:
-			m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) calling  '+\
-				'(?P<f>.*)\+ @ (?P<n>.*), parent: (?P<p>.*)', line)
+		m = False
+		if ': calling ' in line:
+			m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) .* (?P<f>.*)\: '+\
+				'calling .* @ (?P<n>.*), parent: (?P<p>.*)', line)
 		if m:
 			return True if quick else m.group('t', 'f', 'n', 'p')
+		# legacy "[ t] calling  f+ @ n, parent: p", split without a regex
+		line = line.partition('\n')[0]
+		i = line.rfind('] calling  ')
+		pc = line.rfind(', parent: ')
+		at = line.rfind('+ @ ', i + 11, pc) if i >= 0 and pc > i else -1
+		j = line.rfind('[', 0, i) if at >= 0 else -1
+		if j >= 0:
+			t = line[j+1:i].lstrip(' ')
+			if not t.strip('0123456789.'):
+				if quick:
+					return True
+				return (t, line[i+11:at], line[at+4:pc], line[pc+10:])
 		return False if quick else ('', '', '', '')
 	def initcall_debug_return(self, line, quick=False):
-		m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) .* (?P<f>.*)\: '+\
-			'.* returned (?P<r>[0-9]*) after (?P<dt>[0-9]*) usecs', line)
-		if not m:
-			m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) call '+\
-				'(?P<f>.*)\+ returned .* after (?P<dt>.*) usecs', line)
+		m = False
+		if ' returned ' in line and ': ' in line:
+			m = re.match('.*(\[ *)(?P<t>[0-9\.]*)(\]) .* (?P<f>.*)\: '+\
+				'.* returned (?P<r>[0-9]*) after (?P<dt>[0-9]*) usecs', line)
 		if m:
 			return True if quick else m.group('t', 'f', 'dt')
+		# legacy "[ t] call f+ returned r after dt usecs", split without a regex
+		line = line.partition('\n')[0]
+		i = line.rfind('] call ')
+		us = line.rfind(' usecs')
+		af = line.rfind(' after ', 0, us) if i >= 0 and us > i else -1
+		rt = line.rfind('+ returned ', i + 7, af) if af >= 0 else -1
+		j = line.rfind('[', 0, i) if rt >= 0 else -1
+		if j >= 0:
+			t = line[j+1:i].lstrip(' ')
+			if not t.strip('0123456789.'):
+				if quick:
+					return True
+				return (t, line[i+7:rt], line[af+7:us])
 		return False if quick else ('', '', '')
 	def debugPrint(self):
 		for p in self.sortedPhases():
@@ -2214,6 +2277,8 @@ class DevFunction:
 #			 suspend_resume: phase or custom exec block data
 #			 device_pm_callback: device callback info
 class FTraceLine:
+	__slots__ = ('length', 'fcall', 'freturn', 'fevent', 'fkprobe',
+		'depth', 'name', 'type', 'time')
 	def __init__(self, t, m='', d=''):
 		self.length = 0.0
 		self.fcall = False
@@ -2265,6 +2330,7 @@ class FTraceLine:
 			return
 		self.depth = self.getDepth(match.group('d'))
 		m = match.group('o')
+		# function names repeat on every call, share one string per name
 		# function return
 		if(m[0] == '}'):
 			self.freturn = True
@@ -2272,7 +2338,7 @@ class FTraceLine:
 				# includes comment with function name
 				match = re.match('^} *\/\* *(?P<n>.*) *\*\/$', m)
 				if(match):
-					self.name = match.group('n').strip()
+					self.name = sys.intern(match.group('n').strip())
 		# function call
 		else:
 			self.fcall = True
@@ -2280,13 +2346,13 @@ class FTraceLine:
 			if(m[-1] == '{'):
 				match = re.match('^(?P<n>.*) *\(.*', m)
 				if(match):
-					self.name = match.group('n').strip()
+					self.name = sys.intern(match.group('n').strip())
 			# function call with no children (leaf)
 			elif(m[-1] == ';'):
 				self.freturn = True
 				match = re.match('^(?P<n>.*) *\(.*', m)
 				if(match):
-					self.name = match.group('n').strip()
+					self.name = sys.intern(match.group('n').strip())
 			# something else (possibly a trace marker)
 			else:
 				self.name = m
@@ -2342,6 +2408,8 @@ class FTraceLine:
 #	 Each instance is tied to a single device in a single phase, and is
 #	 comprised of an ordered list of FTraceLine objects
 class FTraceCallGraph:
+	__slots__ = ('id', 'invalid', 'name', 'partial', 'ignore', 'start',
+		'end', 'list', 'depth', 'pid', 'sv')
 	vfname = 'missing_function_name'
 	def __init__(self, pid, sv):
 		self.id = ''
@@ -2594,28 +2662,19 @@ class FTraceCallGraph:
 		if(self.name in borderphase):
 			p = borderphase[self.name]
 			list = data.dmesg[p]['list']
-			for devname in list:
+			for devname in data.devicesInRange(p, pid, self.start, self.end):
 				dev = list[devname]
-				if(pid == dev['pid'] and
-					self.start <= dev['start'] and
-					self.end >= dev['end']):
-					cg = self.slice(dev)
-					if cg:
-						dev['ftrace'] = cg
-					found = devname
+				cg = self.slice(dev)
+				if cg:
+					dev['ftrace'] = cg
+				found = devname
 			return found
-		for p in data.sortedPhases():
-			if(data.dmesg[p]['start'] <= self.start and
-				self.start <= data.dmesg[p]['end']):
-				list = data.dmesg[p]['list']
-				for devname in sorted(list, key=lambda k:list[k]['start']):
-					dev = list[devname]
-					if(pid == dev['pid'] and
-						self.start <= dev['start'] and
-						self.end >= dev['end']):
-						dev['ftrace'] = self
-						found = devname
-						break
+		for pstart, pend, p in data.phaseranges:
+			if(pstart <= self.start and self.start <= pend):
+				devlist = data.devicesInRange(p, pid, self.start, self.end)
+				if devlist:
+					found = devlist[0]
+					data.dmesg[p]['list'][found]['ftrace'] = self
 				break
 		return found
 	def newActionFromFunction(self, data):
@@ -2627,9 +2686,8 @@ class FTraceCallGraph:
 		if fs < data.start or fe > data.end:
 			return
 		phase = ''
-		for p in data.sortedPhases():
-			if(data.dmesg[p]['start'] <= self.start and
-				self.start < data.dmesg[p]['end']):
+		for pstart, pend, p in data.phaseranges:
+			if(pstart <= self.start and self.start < pend):
 				phase = p
 				break
 		if not phase:
@@ -2675,7 +2733,7 @@ class Timeline:
 	html_phaselet = '<div id="{0}" class="phaselet" style="left:{1}%;width:{2}%;background:{3}"></div>\n'
 	html_legend = '<div id="p{3}" class="square" style="left:{0}%;background:{1}">&nbsp;{2}</div>\n'
 	def __init__(self, rowheight, scaleheight):
-		self.html = ''
+		self.html = []   # html chunks, joined when written out
 		self.height = 0  # total timeline height
 		self.scaleH = scaleheight # timescale (top) row height
 		self.rowH = rowheight     # device row height
@@ -2686,21 +2744,21 @@ class Timeline:
 	def createHeader(self, sv, stamp):
 		if(not stamp['time']):
 			return
-		self.html += '<div class="version"><a href="https://01.org/pm-graph">%s v%s</a></div>' \
-			% (sv.title, sv.version)
+		self.html.append('<div class="version"><a href="https://01.org/pm-graph">%s v%s</a></div>' \
+			% (sv.title, sv.version))
 		if sv.logmsg and sv.testlog:
-			self.html += '<button id="showtest" class="logbtn btnfmt">log</button>'
+			self.html.append('<button id="showtest" class="logbtn btnfmt">log</button>')
 		if sv.dmesglog:
-			self.html += '<button id="showdmesg" class="logbtn btnfmt">dmesg</button>'
+			self.html.append('<button id="showdmesg" class="logbtn btnfmt">dmesg</button>')
 		if sv.ftracelog:
-			self.html += '<button id="showftrace" class="logbtn btnfmt">ftrace</button>'
+			self.html.append('<button id="showftrace" class="logbtn btnfmt">ftrace</button>')
 		headline_stamp = '<div class="stamp">{0} {1} {2} {3}</div>\n'
-		self.html += headline_stamp.format(stamp['host'], stamp['kernel'],
-			stamp['mode'], stamp['time'])
+		self.html.append(headline_stamp.format(stamp['host'], stamp['kernel'],
+			stamp['mode'], stamp['time']))
 		if 'man' in stamp and 'plat' in stamp and 'cpu' in stamp and \
 			stamp['man'] and stamp['plat'] and stamp['cpu']:
 			headline_sysinfo = '<div class="stamp sysinfo">{0} {1} <i>with</i> {2}</div>\n'
-			self.html += headline_sysinfo.format(stamp['man'], stamp['plat'], stamp['cpu'])
+			self.html.append(headline_sysinfo.format(stamp['man'], stamp['plat'], stamp['cpu']))
 
 	# Function: getDeviceRows
 	# Description:
@@ -2716,30 +2774,27 @@ class Timeline:
 			item.row = -1
 			sortdict[item] = item.length
 		sortlist = sorted(sortdict, key=sortdict.get, reverse=True)
-		remaining = len(sortlist)
-		rowdata = dict()
+		# extract the time ranges once, the packing loop only compares floats
+		pending = [(i, i.time, i.time + i.length) for i in sortlist]
 		row = 1
 		# try to pack each row with as many ranges as possible
-		while(remaining > 0):
-			if(row not in rowdata):
-				rowdata[row] = []
-			for i in sortlist:
-				if(i.row >= 0):
-					continue
-				s = i.time
-				e = i.time + i.length
+		while(len(pending) > 0):
+			rowtimes = []
+			unplaced = []
+			for entry in pending:
+				i, s, e = entry
 				valid = True
-				for ritem in rowdata[row]:
-					rs = ritem.time
-					re = ritem.time + ritem.length
+				for rs, re in rowtimes:
 					if(not (((s <= rs) and (e <= rs)) or
 						((s >= re) and (e >= re)))):
 						valid = False
 						break
 				if(valid):
-					rowdata[row].append(i)
+					rowtimes.append((s, e))
 					i.row = row
-					remaining -= 1
+				else:
+					unplaced.append(entry)
+			pending = unplaced
 			row += 1
 		return row
 	# Function: getPhaseRows
@@ -2752,7 +2807,6 @@ class Timeline:
 	#	 The total number of rows needed to display this phase of the timeline
 	def getPhaseRows(self, devlist, row=0, sortby='length'):
 		# clear all rows and set them to undefined
-		remaining = len(devlist)
 		rowdata = dict()
 		sortdict = dict()
 		myphases = []
@@ -2780,30 +2834,33 @@ class Timeline:
 		for item in sortlist:
 			if item not in orderedlist:
 				orderedlist.append(item)
+		# extract the time ranges once, the packing loop only compares floats
+		pending = [(item, item.dev['start'], item.dev['end']) for item in orderedlist]
 		# try to pack each row with as many devices as possible
-		while(remaining > 0):
+		while(len(pending) > 0):
 			rowheight = 1
 			if(row not in rowdata):
 				rowdata[row] = []
-			for item in orderedlist:
-				dev = item.dev
-				if(dev['row'] < 0):
-					s = dev['start']
-					e = dev['end']
-					valid = True
-					for ritem in rowdata[row]:
-						rs = ritem.dev['start']
-						re = ritem.dev['end']
-						if(not (((s <= rs) and (e <= rs)) or
-							((s >= re) and (e >= re)))):
-							valid = False
-							break
-					if(valid):
-						rowdata[row].append(item)
-						dev['row'] = row
-						remaining -= 1
-						if 'devrows' in dev and dev['devrows'] > rowheight:
-							rowheight = dev['devrows']
+			rowtimes = []
+			unplaced = []
+			for entry in pending:
+				item, s, e = entry
+				valid = True
+				for rs, re in rowtimes:
+					if(not (((s <= rs) and (e <= rs)) or
+						((s >= re) and (e >= re)))):
+						valid = False
+						break
+				if(valid):
+					rowdata[row].append(item)
+					rowtimes.append((s, e))
+					dev = item.dev
+					dev['row'] = row
+					if 'devrows' in dev and dev['devrows'] > rowheight:
+						rowheight = dev['devrows']
+				else:
+					unplaced.append(entry)
+			pending = unplaced
 			for t, p in myphases:
 				if t not in self.rowlines or t not in self.rowheight:
 					self.rowlines[t] = dict()
@@ -2859,12 +2916,12 @@ class Timeline:
 		html_devlist2 = '<button id="devlist2" class="devlist" style="float:right;">Device Detail2</button>\n'
 		if mode != 'command':
 			if testcount > 1:
-				self.html += html_devlist2
-				self.html += html_devlist1.format('1')
+				self.html.append(html_devlist2)
+				self.html.append(html_devlist1.format('1'))
 			else:
-				self.html += html_devlist1.format('')
-		self.html += html_zoombox
-		self.html += html_timeline.format('dmesg', self.height)
+				self.html.append(html_devlist1.format(''))
+		self.html.append(html_zoombox)
+		self.html.append(html_timeline.format('dmesg', self.height))
 	# Function: createTimeScale
 	# Description:
 	#	 Create the timescale for a timeline block
@@ -2874,16 +2931,16 @@ class Timeline:
 	#	 tTotal: total timeline time
 	#	 mode: suspend or resume
 	# Output:
-	#	 The html code needed to display the time scale
+	#	 The html code needed to display the time scale, appended to self.html
 	def createTimeScale(self, m0, mMax, tTotal, mode):
 		timescale = '<div class="t" style="right:{0}%">{1}</div>\n'
 		rline = '<div class="t" style="left:0;border-left:1px solid black;border-right:0;">{0}</div>\n'
-		output = '<div class="timescale">\n'
 		# set scale for timeline
 		mTotal = mMax - m0
 		tS = 0.1
 		if(tTotal <= 0):
-			return output+'</div>\n'
+			return
+		self.html.append('<div class="timescale">\n')
 		if(tTotal > 4):
 			tS = 1
 		divTotal = int(mTotal/tS) + 1
@@ -2902,8 +2959,8 @@ class Timeline:
 				htmlline = timescale.format(pos, val)
 				if(i == 0):
 					htmlline = rline.format(mode)
-			output += htmlline
-		self.html += output+'</div>\n'
+			self.html.append(htmlline)
+		self.html.append('</div>\n')
 
 # Class: TestProps
 # Description:
@@ -3261,6 +3318,7 @@ def appendIncompleteTraceLog(testruns):
 	tf.close()
 
 	for test in testrun:
+		test.data.initDeviceIndex()
 		# add the callgraph data to the device hierarchy
 		for pid in test.ftemp:
 			for cg in test.ftemp[pid]:
@@ -3273,16 +3331,11 @@ def appendIncompleteTraceLog(testruns):
 					continue
 				callstart = cg.start
 				callend = cg.end
-				for p in test.data.sortedPhases():
-					if(test.data.dmesg[p]['start'] <= callstart and
-						callstart <= test.data.dmesg[p]['end']):
+				for pstart, pend, p in test.data.phaseranges:
+					if(pstart <= callstart and callstart <= pend):
 						list = test.data.dmesg[p]['list']
-						for devname in list:
-							dev = list[devname]
-							if(pid == dev['pid'] and
-								callstart <= dev['start'] and
-								callend >= dev['end']):
-								dev['ftrace'] = cg
+						for devname in test.data.devicesInRange(p, pid, callstart, callend):
+							list[devname]['ftrace'] = cg
 						break
 
 # Function: parseTraceLog
@@ -3444,6 +3497,7 @@ def parseTraceLog(live=False):
 									t.time - data.dmesg[lp]['start']
 							data.currphase = ''
 							del data.dmesg[lp]
+							data.phasecache = []
 							continue
 						phase = data.setPhase('suspend_machine', data.dmesg[lp]['end'], True)
 						data.setPhase(phase, t.time, False)
@@ -3663,6 +3717,7 @@ def parseTraceLog(live=False):
 						data.addDeviceFunctionCall(e['name'], name, e['proc'], pid, kb,
 							ke, e['cdata'], e['rdata'])
 		if sysvals.usecallgraph:
+			data.initDeviceIndex()
 			# add the callgraph data to the device hierarchy
 			sortlist = dict()
 			for key in sorted(test.ftemp):
@@ -4089,22 +4144,28 @@ def callgraphHTML(sv, hf, num, cg, title, color, devid):
 
 	fmt = '<r>(%.3f ms @ '+sv.timeformat+' to '+sv.timeformat+')</r>'
 	flen = fmt % (cglen, cg.start, cg.end)
-	hf.write(html_func_top.format(cgid, color, num, title, flen))
+	# collect the whole callgraph and write it in one go
+	out = [html_func_top.format(cgid, color, num, title, flen)]
 	num += 1
+	fmt = '<n>(%.3f ms @ '+sv.timeformat+')</n>'
+	# bind the per-line methods once, this loop runs for every trace line
+	add, leaf, start = out.append, html_func_leaf.format, html_func_start.format
 	for line in cg.list:
+		# a return only closes its article, it needs no length text
+		if line.freturn and not line.fcall:
+			add(html_func_end)
+			continue
 		if(line.length < 0.000000001):
 			flen = ''
 		else:
-			fmt = '<n>(%.3f ms @ '+sv.timeformat+')</n>'
 			flen = fmt % (line.length*1000, line.time)
-		if line.isLeaf():
-			hf.write(html_func_leaf.format(line.name, flen))
-		elif line.freturn:
-			hf.write(html_func_end)
+		if line.freturn:
+			add(leaf(line.name, flen))
 		else:
-			hf.write(html_func_start.format(num, line.name, flen))
+			add(start(num, line.name, flen))
 			num += 1
-	hf.write(html_func_end)
+	out.append(html_func_end)
+	hf.write(''.join(out))
 	return num
 
 def addCallgraphs(sv, hf, data):
@@ -4115,13 +4176,12 @@ def addCallgraphs(sv, hf, data):
 		if sv.cgphase and p != sv.cgphase:
 			continue
 		list = data.dmesg[p]['list']
+		pcolor = data.dmesg[p]['color'] if 'color' in data.dmesg[p] else 'white'
 		for d in data.sortedDevices(p):
 			if len(sv.cgfilter) > 0 and d not in sv.cgfilter:
 				continue
 			dev = list[d]
-			color = 'white'
-			if 'color' in data.dmesg[p]:
-				color = data.dmesg[p]['color']
+			color = pcolor
 			if 'color' in dev:
 				color = dev['color']
 			name = d if '[' not in d else d.split('[')[0]
@@ -4170,7 +4230,8 @@ def summaryCSS(title, center=True):
 #	 testruns: array of Data objects from parseTraceLog
 def createHTMLSummarySimple(testruns, htmlfile, title):
 	# write the html header first (html head, css code, up to body start)
-	html = summaryCSS('Summary - SleepGraph')
+	html = io.StringIO()
+	html.write(summaryCSS('Summary - SleepGraph'))
 
 	# extract the test data into list
 	list = dict()
@@ -4241,7 +4302,7 @@ def createHTMLSummarySimple(testruns, htmlfile, title):
 	for ilk in sorted(cnt, reverse=True):
 		if cnt[ilk] > 0:
 			desc.append('%d %s' % (cnt[ilk], ilk))
-	html += '<div class="stamp">%s (%d tests: %s)</div>\n' % (title, len(testruns), ', '.join(desc))
+	html.write('<div class="stamp">%s (%d tests: %s)</div>\n' % (title, len(testruns), ', '.join(desc)))
 	th = '\t<th>{0}</th>\n'
 	td = '\t<td>{0}</td>\n'
 	tdh = '\t<td{1}>{0}</td>\n'
@@ -4254,17 +4315,17 @@ def createHTMLSummarySimple(testruns, htmlfile, title):
 	colspan = '%d' % cols
 
 	# table header
-	html += '<table>\n<tr>\n' + th.format('#') +\
+	html.write('<table>\n<tr>\n' + th.format('#') +\
 		th.format('Mode') + th.format('Host') + th.format('Kernel') +\
 		th.format('Test Time') + th.format('Result') + th.format('Issues') +\
 		th.format('Suspend') + th.format('Resume') +\
 		th.format('Worst Suspend Device') + th.format('SD Time') +\
-		th.format('Worst Resume Device') + th.format('RD Time')
+		th.format('Worst Resume Device') + th.format('RD Time'))
 	if useturbo:
-		html += th.format('PkgPC10') + th.format('SysLPI')
+		html.write(th.format('PkgPC10') + th.format('SysLPI'))
 	if usewifi:
-		html += th.format('Wifi')
-	html += th.format('Detail')+'</tr>\n'
+		html.write(th.format('Wifi'))
+	html.write(th.format('Detail')+'</tr>\n')
 	# export list into html
 	head = '<tr class="head"><td>{0}</td><td>{1}</td>'+\
 		'<td colspan='+colspan+' class="sus">Suspend Avg={2} '+\
@@ -4286,20 +4347,20 @@ def createHTMLSummarySimple(testruns, htmlfile, title):
 		count = len(list[mode]['data'])
 		if 'idx' in list[mode]:
 			iMin, iMed, iMax = list[mode]['idx']
-			html += head.format('%d' % count, mode.upper(),
+			html.write(head.format('%d' % count, mode.upper(),
 				'%.3f' % tAvg[0], '%.3f' % tMin[0], '%.3f' % tMed[0], '%.3f' % tMax[0],
 				'%.3f' % tAvg[1], '%.3f' % tMin[1], '%.3f' % tMed[1], '%.3f' % tMax[1],
 				mode.lower()
-			)
+			))
 		else:
 			iMin = iMed = iMax = [-1, -1, -1]
-			html += headnone.format('%d' % count, mode.upper())
+			html.write(headnone.format('%d' % count, mode.upper()))
 		for d in list[mode]['data']:
 			# row classes - alternate row color
 			rcls = ['alt'] if num % 2 == 1 else []
 			if d[6] != 'pass':
 				rcls.append('notice')
-			html += '<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n'
+			html.write('<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n')
 			# figure out if the line has sus or res highlighted
 			idx = list[mode]['data'].index(d)
 			tHigh = ['', '']
@@ -4311,35 +4372,36 @@ def createHTMLSummarySimple(testruns, htmlfile, title):
 					tHigh[i] = ' id="%smax" class=maxval title="Maximum"' % tag
 				elif idx == iMed[i]:
 					tHigh[i] = ' id="%smed" class=medval title="Median"' % tag
-			html += td.format("%d" % (list[mode]['data'].index(d) + 1)) # row
-			html += td.format(mode)										# mode
-			html += td.format(d[0])										# host
-			html += td.format(d[1])										# kernel
-			html += td.format(d[2])										# time
-			html += td.format(d[6])										# result
-			html += td.format(d[7])										# issues
-			html += tdh.format('%.3f ms' % d[3], tHigh[0]) if d[3] else td.format('')	# suspend
-			html += tdh.format('%.3f ms' % d[4], tHigh[1]) if d[4] else td.format('')	# resume
-			html += td.format(d[8])										# sus_worst
-			html += td.format('%.3f ms' % d[9])	if d[9] else td.format('')		# sus_worst time
-			html += td.format(d[10])									# res_worst
-			html += td.format('%.3f ms' % d[11]) if d[11] else td.format('')	# res_worst time
+			html.write(td.format("%d" % (list[mode]['data'].index(d) + 1))) # row
+			html.write(td.format(mode))										# mode
+			html.write(td.format(d[0]))										# host
+			html.write(td.format(d[1]))										# kernel
+			html.write(td.format(d[2]))										# time
+			html.write(td.format(d[6]))										# result
+			html.write(td.format(d[7]))										# issues
+			html.write(tdh.format('%.3f ms' % d[3], tHigh[0]) if d[3] else td.format(''))	# suspend
+			html.write(tdh.format('%.3f ms' % d[4], tHigh[1]) if d[4] else td.format(''))	# resume
+			html.write(td.format(d[8]))										# sus_worst
+			html.write(td.format('%.3f ms' % d[9])	if d[9] else td.format(''))		# sus_worst time
+			html.write(td.format(d[10]))									# res_worst
+			html.write(td.format('%.3f ms' % d[11]) if d[11] else td.format(''))	# res_worst time
 			if useturbo:
-				html += td.format(d[12])								# pkg_pc10
-				html += td.format(d[13])								# syslpi
+				html.write(td.format(d[12]))								# pkg_pc10
+				html.write(td.format(d[13]))								# syslpi
 			if usewifi:
-				html += td.format(d[14])								# wifi
-			html += tdlink.format(d[5]) if d[5] else td.format('')		# url
-			html += '</tr>\n'
+				html.write(td.format(d[14]))								# wifi
+			html.write(tdlink.format(d[5]) if d[5] else td.format(''))		# url
+			html.write('</tr>\n')
 			num += 1
 
 	# flush the data to file
 	hf = open(htmlfile, 'w')
-	hf.write(html+'</table>\n</body>\n</html>\n')
+	hf.write(html.getvalue()+'</table>\n</body>\n</html>\n')
 	hf.close()
 
 def createHTMLDeviceSummary(testruns, htmlfile, title):
-	html = summaryCSS('Device Summary - SleepGraph', False)
+	html = io.StringIO()
+	html.write(summaryCSS('Device Summary - SleepGraph', False))
 
 	# create global device list from all tests
 	devall = dict()
@@ -4373,12 +4435,12 @@ def createHTMLDeviceSummary(testruns, htmlfile, title):
 		num = 0
 		devlist = devall[type]
 		# table header
-		html += '<div class="stamp">%s (%s devices > %d ms)</div><table>\n' % \
-			(title, type.upper(), limit)
-		html += '<tr>\n' + '<th align=right>Device Name</th>' +\
+		html.write('<div class="stamp">%s (%s devices > %d ms)</div><table>\n' % \
+			(title, type.upper(), limit))
+		html.write('<tr>\n' + '<th align=right>Device Name</th>' +\
 			th.format('Average Time') + th.format('Count') +\
 			th.format('Worst Time') + th.format('Host (worst time)') +\
-			th.format('Link (worst time)') + '</tr>\n'
+			th.format('Link (worst time)') + '</tr>\n')
 		for name in sorted(devlist, key=lambda k:(devlist[k]['worst'], \
 			devlist[k]['total'], devlist[k]['name']), reverse=True):
 			data = devall[type][name]
@@ -4387,26 +4449,27 @@ def createHTMLDeviceSummary(testruns, htmlfile, title):
 				continue
 			# row classes - alternate row color
 			rcls = ['alt'] if num % 2 == 1 else []
-			html += '<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n'
-			html += tdr.format(data['name'])				# name
-			html += td.format('%.3f ms' % data['average'])	# average
-			html += td.format(data['count'])				# count
-			html += td.format('%.3f ms' % data['worst'])	# worst
-			html += td.format(data['host'])					# host
-			html += tdlink.format(data['url'])				# url
-			html += '</tr>\n'
+			html.write('<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n')
+			html.write(tdr.format(data['name']))				# name
+			html.write(td.format('%.3f ms' % data['average']))	# average
+			html.write(td.format(data['count']))				# count
+			html.write(td.format('%.3f ms' % data['worst']))	# worst
+			html.write(td.format(data['host']))					# host
+			html.write(tdlink.format(data['url']))				# url
+			html.write('</tr>\n')
 			num += 1
-		html += '</table>\n'
+		html.write('</table>\n')
 
 	# flush the data to file
 	hf = open(htmlfile, 'w')
-	hf.write(html+'</body>\n</html>\n')
+	hf.write(html.getvalue()+'</body>\n</html>\n')
 	hf.close()
 	return devall
 
 def createHTMLIssuesSummary(testruns, issues, htmlfile, title, extra=''):
 	multihost = len([e for e in issues if len(e['urls']) > 1]) > 0
-	html = summaryCSS('Issues Summary - SleepGraph', False)
+	html = io.StringIO()
+	html.write(summaryCSS('Issues Summary - SleepGraph', False))
 	total = len(testruns)
 
 	# generate the html
@@ -4414,12 +4477,12 @@ def createHTMLIssuesSummary(testruns, issues, htmlfile, title, extra=''):
 	td = '\t<td align={0}>{1}</td>\n'
 	tdlink = '<a href="{1}">{0}</a>'
 	subtitle = '%d issues' % len(issues) if len(issues) > 0 else 'no issues'
-	html += '<div class="stamp">%s (%s)</div><table>\n' % (title, subtitle)
-	html += '<tr>\n' + th.format('Issue') + th.format('Count')
+	html.write('<div class="stamp">%s (%s)</div><table>\n' % (title, subtitle))
+	html.write('<tr>\n' + th.format('Issue') + th.format('Count'))
 	if multihost:
-		html += th.format('Hosts')
-	html += th.format('Tests') + th.format('Fail Rate') +\
-		th.format('First Instance') + '</tr>\n'
+		html.write(th.format('Hosts'))
+	html.write(th.format('Tests') + th.format('Fail Rate') +\
+		th.format('First Instance') + '</tr>\n')
 
 	num = 0
 	for e in sorted(issues, key=lambda v:v['count'], reverse=True):
@@ -4431,20 +4494,20 @@ def createHTMLIssuesSummary(testruns, issues, htmlfile, title, extra=''):
 		rate = '%d/%d (%.2f%%)' % (testtotal, total, 100*float(testtotal)/float(total))
 		# row classes - alternate row color
 		rcls = ['alt'] if num % 2 == 1 else []
-		html += '<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n'
-		html += td.format('left', e['line'])		# issue
-		html += td.format('center', e['count'])		# count
+		html.write('<tr class="'+(' '.join(rcls))+'">\n' if len(rcls) > 0 else '<tr>\n')
+		html.write(td.format('left', e['line']))		# issue
+		html.write(td.format('center', e['count']))		# count
 		if multihost:
-			html += td.format('center', len(e['urls']))	# hosts
-		html += td.format('center', testtotal)		# test count
-		html += td.format('center', rate)			# test rate
-		html += td.format('center nowrap', '<br>'.join(links))	# links
-		html += '</tr>\n'
+			html.write(td.format('center', len(e['urls'])))	# hosts
+		html.write(td.format('center', testtotal))		# test count
+		html.write(td.format('center', rate))			# test rate
+		html.write(td.format('center nowrap', '<br>'.join(links)))	# links
+		html.write('</tr>\n')
 		num += 1
 
 	# flush the data to file
 	hf = open(htmlfile, 'w')
-	hf.write(html+'</table>\n'+extra+'</body>\n</html>\n')
+	hf.write(html.getvalue()+'</table>\n'+extra+'</body>\n</html>\n')
 	hf.close()
 	return issues
 
@@ -4482,8 +4545,9 @@ def createHTML(testruns, testfail):
 
 	# html function templates
 	html_error = '<div id="{1}" title="kernel error/warning" class="err" style="right:{0}%">{2}&rarr;</div>\n'
-	html_traceevent = '<div title="{0}" class="traceevent{6}" style="left:{1}%;top:{2}px;height:{3}px;width:{4}%;line-height:{3}px;{7}">{5}</div>\n'
-	html_cpuexec = '<div class="jiffie" style="left:{0}%;top:{1}px;height:{2}px;width:{3}%;background:{4};"></div>\n'
+	# the per-event templates take raw floats: one % pass per element
+	html_traceevent = '<div title="%s" class="traceevent" style="left:%f%%;top:%.3fpx;height:%.3fpx;width:%f%%;line-height:%.3fpx;%s">%s</div>\n'
+	html_cpuexec = '<div class="jiffie" style="left:%f%%;top:%.3fpx;height:%.3fpx;width:%f%%;background:rgba(255, 0, 0, %f);"></div>\n'
 	html_timetotal = '<table class="time1">\n<tr>'\
 		'<td class="green" title="{3}">{2} Suspend Time: <b>{0} ms</b></td>'\
 		'<td class="yellow" title="{4}">{2} Resume Time: <b>{1} ms</b></td>'\
@@ -4527,7 +4591,7 @@ def createHTML(testruns, testfail):
 			if(len(testruns) > 1):
 				testdesc = ordinal(data.testnumber+1)+' '+testdesc
 			thtml = html_timetotal3.format(run_time, testdesc)
-			devtl.html += thtml
+			devtl.html.append(thtml)
 			continue
 		# typical full suspend/resume header
 		stot, rtot = sktime, rktime = data.getTimeValues()
@@ -4557,7 +4621,7 @@ def createHTML(testruns, testfail):
 			low_time = '+'.join(data.tLow)
 			thtml = html_timetotal2.format(suspend_time, low_time, \
 				resume_time, testdesc, stitle, rtitle)
-		devtl.html += thtml
+		devtl.html.append(thtml)
 		if not data.fwValid and 'dev' not in data.wifi:
 			continue
 		# extra detail when the times come from multiple sources
@@ -4576,9 +4640,9 @@ def createHTML(testruns, testfail):
 				wtime = 'TIMEOUT'
 			thtml += html_wifdesc.format(testdesc2, wtime, data.wifi['dev'])
 		thtml += '</tr>\n</table>\n'
-		devtl.html += thtml
+		devtl.html.append(thtml)
 	if testfail:
-		devtl.html += html_fail.format(testfail)
+		devtl.html.append(html_fail.format(testfail))
 
 	# time scale for potentially multiple datasets
 	t0 = testruns[0].start
@@ -4627,6 +4691,9 @@ def createHTML(testruns, testfail):
 
 	# draw the full timeline
 	devtl.createZoomBox(sysvals.suspendmode, len(testruns))
+	phasetop, phaseheight = '%.3f' % devtl.scaleH, '%.3f' % devtl.bodyH
+	devicefmt = devtl.html_device.format
+	devprops = sysvals.devprops
 	for data in testruns:
 		# draw each test run and block chronologically
 		phases = {'suspend':[],'resume':[]}
@@ -4655,22 +4722,21 @@ def createHTML(testruns, testfail):
 			if mTotal == 0:
 				continue
 			width = '%f' % (((mTotal*100.0)-sysvals.srgap/2)/tTotal)
-			devtl.html += devtl.html_tblock.format(bname, left, width, devtl.scaleH)
+			devtl.html.append(devtl.html_tblock.format(bname, left, width, devtl.scaleH))
 			for b in phases[dir]:
 				# draw the phase color background
 				phase = data.dmesg[b]
 				length = phase['end']-phase['start']
 				left = '%f' % (((phase['start']-m0)*100.0)/mTotal)
 				width = '%f' % ((length*100.0)/mTotal)
-				devtl.html += devtl.html_phase.format(left, width, \
-					'%.3f'%devtl.scaleH, '%.3f'%devtl.bodyH, \
-					data.dmesg[b]['color'], '')
+				devtl.html.append(devtl.html_phase.format(left, width, \
+					phasetop, phaseheight, phase['color'], ''))
 			for e in data.errorinfo[dir]:
 				# draw red lines for any kernel errors found
 				type, t, idx1, idx2 = e
 				id = '%d_%d' % (idx1, idx2)
 				right = '%f' % (((mMax-t)*100.0)/mTotal)
-				devtl.html += html_error.format(right, id, type)
+				devtl.html.append(html_error.format(right, id, type))
 			for b in phases[dir]:
 				# draw the devices for this phase
 				phaselist = data.dmesg[b]['list']
@@ -4682,10 +4748,11 @@ def createHTML(testruns, testfail):
 						xtraclass = dev['htmlclass']
 					if 'color' in dev:
 						xtrastyle = 'background:%s;' % dev['color']
-					if(d in sysvals.devprops):
-						name = sysvals.devprops[d].altName(d)
-						xtraclass = sysvals.devprops[d].xtraClass()
-						xtrainfo = sysvals.devprops[d].xtraInfo()
+					if(d in devprops):
+						prop = devprops[d]
+						name = prop.altName(d)
+						xtraclass = prop.xtraClass()
+						xtrainfo = prop.xtraInfo()
 					elif xtraclass == ' kth':
 						xtrainfo = ' kernel_thread'
 					if('drv' in dev and dev['drv']):
@@ -4706,49 +4773,45 @@ def createHTML(testruns, testfail):
 							title += 'post_resume_process'
 					else:
 						title += b
-					devtl.html += devtl.html_device.format(dev['id'], \
+					devtl.html.append(devicefmt(dev['id'], \
 						title, left, top, '%.3f'%rowheight, width, \
-						dname+drv, xtraclass, xtrastyle)
+						dname+drv, xtraclass, xtrastyle))
 					if('cpuexec' in dev):
+						height = rowheight/3
+						top = rowtop + devtl.scaleH + 2*rowheight/3
 						for t in sorted(dev['cpuexec']):
 							start, end = t
 							j = float(dev['cpuexec'][t]) / 5
 							if j > 1.0:
 								j = 1.0
-							height = '%.3f' % (rowheight/3)
-							top = '%.3f' % (rowtop + devtl.scaleH + 2*rowheight/3)
-							left = '%f' % (((start-m0)*100)/mTotal)
-							width = '%f' % ((end-start)*100/mTotal)
-							color = 'rgba(255, 0, 0, %f)' % j
-							devtl.html += \
-								html_cpuexec.format(left, top, height, width, color)
+							devtl.html.append(html_cpuexec % \
+								(((start-m0)*100)/mTotal, top, height,
+								(end-start)*100/mTotal, j))
 					if('src' not in dev):
 						continue
 					# draw any trace events for this device
+					height = devtl.rowH
 					for e in dev['src']:
 						if e.length == 0:
 							continue
-						height = '%.3f' % devtl.rowH
-						top = '%.3f' % (rowtop + devtl.scaleH + (e.row*devtl.rowH))
-						left = '%f' % (((e.time-m0)*100)/mTotal)
-						width = '%f' % (e.length*100/mTotal)
+						top = rowtop + devtl.scaleH + (e.row*height)
 						xtrastyle = ''
 						if e.color:
 							xtrastyle = 'background:%s;' % e.color
-						devtl.html += \
-							html_traceevent.format(e.title(), \
-								left, top, height, width, e.text(), '', xtrastyle)
+						devtl.html.append(html_traceevent % (e.title(),
+							((e.time-m0)*100)/mTotal, top, height,
+							e.length*100/mTotal, height, xtrastyle, e.text()))
 			# draw the time scale, try to make the number of labels readable
 			devtl.createTimeScale(m0, mMax, tTotal, dir)
-			devtl.html += '</div>\n'
+			devtl.html.append('</div>\n')
 
 	# timeline is finished
-	devtl.html += '</div>\n</div>\n'
+	devtl.html.append('</div>\n</div>\n')
 
 	# draw a legend which describes the phases by color
 	if sysvals.suspendmode != 'command':
 		phasedef = testruns[-1].phasedef
-		devtl.html += '<div class="legend">\n'
+		devtl.html.append('<div class="legend">\n')
 		pdelta = 100.0/len(phasedef.keys())
 		pmargin = pdelta / 4.0
 		for phase in sorted(phasedef, key=lambda k:phasedef[k]['order']):
@@ -4757,35 +4820,38 @@ def createHTML(testruns, testfail):
 				id += word[0]
 			order = '%.2f' % ((p['order'] * pdelta) + pmargin)
 			name = phase.replace('_', ' &nbsp;')
-			devtl.html += devtl.html_legend.format(order, p['color'], name, id)
-		devtl.html += '</div>\n'
+			devtl.html.append(devtl.html_legend.format(order, p['color'], name, id))
+		devtl.html.append('</div>\n')
 
-	hf = open(sysvals.htmlfile, 'w')
+	# the callgraphs are many small writes, give them a large buffer
+	hf = open(sysvals.htmlfile, 'w', buffering=1<<19)
 	addCSS(hf, sysvals, len(testruns), kerror)
 
-	# write the device timeline
-	hf.write(devtl.html)
-	hf.write('<div id="devicedetailtitle"></div>\n')
-	hf.write('<div id="devicedetail" style="display:none;">\n')
+	# add the device detail boxes to the timeline
+	devtl.html.append('<div id="devicedetailtitle"></div>\n')
+	devtl.html.append('<div id="devicedetail" style="display:none;">\n')
 	# draw the colored boxes for the device detail section
 	for data in testruns:
-		hf.write('<div id="devicedetail%d">\n' % data.testnumber)
+		devtl.html.append('<div id="devicedetail%d">\n' % data.testnumber)
 		pscolor = 'linear-gradient(to top left, #ccc, #eee)'
-		hf.write(devtl.html_phaselet.format('pre_suspend_process', \
+		devtl.html.append(devtl.html_phaselet.format('pre_suspend_process', \
 			'0', '0', pscolor))
 		for b in data.sortedPhases():
 			phase = data.dmesg[b]
 			length = phase['end']-phase['start']
 			left = '%.3f' % (((phase['start']-t0)*100.0)/tTotal)
 			width = '%.3f' % ((length*100.0)/tTotal)
-			hf.write(devtl.html_phaselet.format(b, left, width, \
-				data.dmesg[b]['color']))
-		hf.write(devtl.html_phaselet.format('post_resume_process', \
+			devtl.html.append(devtl.html_phaselet.format(b, left, width, \
+				phase['color']))
+		devtl.html.append(devtl.html_phaselet.format('post_resume_process', \
 			'0', '0', pscolor))
 		if sysvals.suspendmode == 'command':
-			hf.write(devtl.html_phaselet.format('cmdexec', '0', '0', pscolor))
-		hf.write('</div>\n')
-	hf.write('</div>\n')
+			devtl.html.append(devtl.html_phaselet.format('cmdexec', '0', '0', pscolor))
+		devtl.html.append('</div>\n')
+	devtl.html.append('</div>\n')
+
+	# write the device timeline and detail in one go
+	hf.write(''.join(devtl.html))
 
 	# write the ftrace data (callgraph)
 	if sysvals.cgtest >= 0 and len(testruns) > sysvals.cgtest:
@@ -4822,37 +4888,11 @@ def createHTML(testruns, testfail):
 	hf.close()
 	return True
 
-def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
-	kernel = sv.stamp['kernel']
-	host = sv.hostname[0].upper()+sv.hostname[1:]
-	mode = sv.suspendmode
-	if sv.suspendmode in suspendmodename:
-		mode = suspendmodename[sv.suspendmode]
-	title = host+' '+mode+' '+kernel
-
-	# various format changes by flags
-	cgchk = 'checked'
-	cgnchk = 'not(:checked)'
-	if sv.cgexp:
-		cgchk = 'not(:checked)'
-		cgnchk = 'checked'
-
-	hoverZ = 'z-index:8;'
-	if sv.usedevsrc:
-		hoverZ = ''
-
-	devlistpos = 'absolute'
-	if testcount > 1:
-		devlistpos = 'relative'
-
-	scaleTH = 20
-	if kerror:
-		scaleTH = 60
-
-	# write the html header first (html head, css code, up to body start)
-	html_header = '<!DOCTYPE html>\n<html>\n<head>\n\
+# the timeline html header (html head, css code, up to body start),
+# parsed once at import and filled in by addCSS
+html_header = string.Template('<!DOCTYPE html>\n<html>\n<head>\n\
 	<meta http-equiv="content-type" content="text/html; charset=UTF-8">\n\
-	<title>'+title+'</title>\n\
+	<title>$title</title>\n\
 	<style type=\'text/css\'>\n\
 		body {overflow-y:scroll;}\n\
 		.stamp {width:100%;text-align:center;background:gray;line-height:30px;color:white;font:25px Arial;}\n\
@@ -4881,16 +4921,16 @@ def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
 		.tdhl {color:red;}\n\
 		.hide {display:none;}\n\
 		.pf {display:none;}\n\
-		.pf:'+cgchk+' + label {background:url(\'data:image/svg+xml;utf,<?xml version="1.0" standalone="no"?><svg xmlns="http://www.w3.org/2000/svg" height="18" width="18" version="1.1"><circle cx="9" cy="9" r="8" stroke="black" stroke-width="1" fill="white"/><rect x="4" y="8" width="10" height="2" style="fill:black;stroke-width:0"/><rect x="8" y="4" width="2" height="10" style="fill:black;stroke-width:0"/></svg>\') no-repeat left center;}\n\
-		.pf:'+cgnchk+' ~ label {background:url(\'data:image/svg+xml;utf,<?xml version="1.0" standalone="no"?><svg xmlns="http://www.w3.org/2000/svg" height="18" width="18" version="1.1"><circle cx="9" cy="9" r="8" stroke="black" stroke-width="1" fill="white"/><rect x="4" y="8" width="10" height="2" style="fill:black;stroke-width:0"/></svg>\') no-repeat left center;}\n\
-		.pf:'+cgchk+' ~ *:not(:nth-child(2)) {display:none;}\n\
+		.pf:$cgchk + label {background:url(\'data:image/svg+xml;utf,<?xml version="1.0" standalone="no"?><svg xmlns="http://www.w3.org/2000/svg" height="18" width="18" version="1.1"><circle cx="9" cy="9" r="8" stroke="black" stroke-width="1" fill="white"/><rect x="4" y="8" width="10" height="2" style="fill:black;stroke-width:0"/><rect x="8" y="4" width="2" height="10" style="fill:black;stroke-width:0"/></svg>\') no-repeat left center;}\n\
+		.pf:$cgnchk ~ label {background:url(\'data:image/svg+xml;utf,<?xml version="1.0" standalone="no"?><svg xmlns="http://www.w3.org/2000/svg" height="18" width="18" version="1.1"><circle cx="9" cy="9" r="8" stroke="black" stroke-width="1" fill="white"/><rect x="4" y="8" width="10" height="2" style="fill:black;stroke-width:0"/></svg>\') no-repeat left center;}\n\
+		.pf:$cgchk ~ *:not(:nth-child(2)) {display:none;}\n\
 		.zoombox {position:relative;width:100%;overflow-x:scroll;-webkit-user-select:none;-moz-user-select:none;user-select:none;}\n\
 		.timeline {position:relative;font-size:14px;cursor:pointer;width:100%; overflow:hidden;background:linear-gradient(#cccccc, white);}\n\
 		.thread {position:absolute;height:0%;overflow:hidden;z-index:7;line-height:30px;font-size:14px;border:1px solid;text-align:center;white-space:nowrap;}\n\
 		.thread.ps {border-radius:3px;background:linear-gradient(to top, #ccc, #eee);}\n\
-		.thread:hover {background:white;border:1px solid red;'+hoverZ+'}\n\
+		.thread:hover {background:white;border:1px solid red;$hoverZ}\n\
 		.thread.sec,.thread.sec:hover {background:black;border:0;color:white;line-height:15px;font-size:10px;}\n\
-		.hover {background:white;border:1px solid red;'+hoverZ+'}\n\
+		.hover {background:white;border:1px solid red;$hoverZ}\n\
 		.hover.sync {background:white;}\n\
 		.hover.bg,.hover.kth,.hover.sync,.hover.ps {background:white;}\n\
 		.jiffie {position:absolute;pointer-events: none;z-index:8;}\n\
@@ -4898,13 +4938,13 @@ def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
 		.traceevent:hover {color:white;font-weight:bold;border:1px solid white;}\n\
 		.phase {position:absolute;overflow:hidden;border:0px;text-align:center;}\n\
 		.phaselet {float:left;overflow:hidden;border:0px;text-align:center;min-height:100px;font-size:24px;}\n\
-		.t {position:absolute;line-height:'+('%d'%scaleTH)+'px;pointer-events:none;top:0;height:100%;border-right:1px solid black;z-index:6;}\n\
+		.t {position:absolute;line-height:${scaleTH}px;pointer-events:none;top:0;height:100%;border-right:1px solid black;z-index:6;}\n\
 		.err {position:absolute;top:0%;height:100%;border-right:3px solid red;color:red;font:bold 14px Times;line-height:18px;}\n\
 		.legend {position:relative; width:100%; height:40px; text-align:center;margin-bottom:20px}\n\
 		.legend .square {position:absolute;cursor:pointer;top:10px; width:0px;height:20px;border:1px solid;padding-left:20px;}\n\
 		button {height:40px;width:200px;margin-bottom:20px;margin-top:20px;font-size:24px;}\n\
 		.btnfmt {position:relative;float:right;height:25px;width:auto;margin-top:3px;margin-bottom:0;font-size:10px;text-align:center;}\n\
-		.devlist {position:'+devlistpos+';width:190px;}\n\
+		.devlist {position:$devlistpos;width:190px;}\n\
 		a:link {color:white;text-decoration:none;}\n\
 		a:visited {color:white;}\n\
 		a:hover {color:white;}\n\
@@ -4914,9 +4954,40 @@ def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
 		.tblock {position:absolute;height:100%;background:#ddd;}\n\
 		.tback {position:absolute;width:100%;background:linear-gradient(#ccc, #ddd);}\n\
 		.bg {z-index:1;}\n\
-'+extra+'\
-	</style>\n</head>\n<body>\n'
-	hf.write(html_header)
+$extra\
+	</style>\n</head>\n<body>\n')
+
+def addCSS(hf, sv, testcount=1, kerror=False, extra=''):
+	kernel = sv.stamp['kernel']
+	host = sv.hostname[0].upper()+sv.hostname[1:]
+	mode = sv.suspendmode
+	if sv.suspendmode in suspendmodename:
+		mode = suspendmodename[sv.suspendmode]
+	title = host+' '+mode+' '+kernel
+
+	# various format changes by flags
+	cgchk = 'checked'
+	cgnchk = 'not(:checked)'
+	if sv.cgexp:
+		cgchk = 'not(:checked)'
+		cgnchk = 'checked'
+
+	hoverZ = 'z-index:8;'
+	if sv.usedevsrc:
+		hoverZ = ''
+
+	devlistpos = 'absolute'
+	if testcount > 1:
+		devlistpos = 'relative'
+
+	scaleTH = 20
+	if kerror:
+		scaleTH = 60
+
+	# write the html header first (html head, css code, up to body start)
+	hf.write(html_header.substitute(title=title, cgchk=cgchk, cgnchk=cgnchk,
+		hoverZ=hoverZ, scaleTH='%d' % scaleTH, devlistpos=devlistpos,
+		extra=extra))
 
 # Function: addScriptCode
 # Description:
@@ -5335,7 +5406,7 @@ def executeSuspend(quiet=False):
 		if not quiet:
 			pprint('SYNCING FILESYSTEMS')
 		sv.dlog('syncing filesystems')
-		call('sync', shell=True)
+		os.sync()
 	sv.dlog('read dmesg')
 	sv.initdmesg()
 	# start ftrace
@@ -5447,8 +5518,8 @@ def executeSuspend(quiet=False):
 			pprint('CAPTURING TRACE')
 		op = sv.writeDatafileHeader(sv.ftracefile, testdata)
 		fp = open(tp+'trace', 'r')
-		for line in fp:
-			op.write(line)
+		shutil.copyfileobj(fp, op, 1<<20)
+		fp.close()
 		op.close()
 		sv.fsetVal('', 'trace')
 		sv.platforminfo(cmdafter)
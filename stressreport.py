@@ -28,6 +28,9 @@ from distutils.dir_util import copy_tree
 from tempfile import NamedTemporaryFile, mkdtemp
 from subprocess import call, Popen, PIPE
 from datetime import datetime
+from operator import itemgetter
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import smtplib
 import sleepgraph as sg
@@ -38,7 +41,45 @@ from lib.googleapi import setupGoogleAPIs, initGoogleAPIs, gdrive_command_simple
 from lib.parallel import MultiProcess, permission_to_run
 
 gslink = '=HYPERLINK("{0}","{1}")'
+testdirre = re.compile('suspend-(?P<d>[0-9]*)-(?P<t>[0-9]*)$')
+# test output files by exact name or by suffix (optionally gzipped)
+testfilenames = {
+	'result.txt': 'result',
+	'dmesg-crash.log': 'crashlog',
+	'sshtest.log': 'sshlog',
+	'test.log': 'log',
+}
+testfilesuffix = [
+	('html', '.html'),
+	('dmesg', '_dmesg.txt'),
+	('ftrace', '_ftrace.txt'),
+]
 gsperc = '=({0}/{1})'
+
+def stamptime(d, t):
+	# build the datetime for a yymmdd/HHMMSS test stamp without strptime,
+	# the stamps are all from 20xx so both paths read yy that way
+	if len(d) != 6 or len(t) != 6:
+		return datetime.strptime('20'+d+t, '%Y%m%d%H%M%S')
+	return datetime(2000+int(d[0:2]), int(d[2:4]), int(d[4:6]),
+		int(t[0:2]), int(t[2:4]), int(t[4:6]))
+
+def gsstr(val):
+	return {'userEnteredValue':{'stringValue':val}}
+
+def gsnum(val):
+	return {'userEnteredValue':{'numberValue':val}}
+
+def gsfloat(val):
+	return {'userEnteredValue':{'numberValue':float(val)}}
+
+# the test data columns which follow the row number
+testcols = [
+	('mode', gsstr), ('host', gsstr), ('kernel', gsstr), ('time', gsstr),
+	('result', gsstr), ('issues', gsstr), ('suspend', gsfloat),
+	('resume', gsfloat), ('sus_worst', gsstr), ('sus_worsttime', gsfloat),
+	('res_worst', gsstr), ('res_worsttime', gsfloat),
+]
 deviceinfo = {'suspend':dict(),'resume':dict()}
 trash = []
 mystarttime = time.time()
@@ -314,7 +355,7 @@ def info(file, data, args, cb=None):
 				cb(op.join(args.folder, url), colidx, values)
 			x = re.match('.*/suspend-(?P<d>[0-9]*)-(?P<t>[0-9]*)/.*', url)
 			if x:
-				testtime = datetime.strptime(x.group('d')+x.group('t'), '%y%m%d%H%M%S')
+				testtime = stamptime(x.group('d'), x.group('t'))
 		if not endtime or testtime > endtime:
 			endtime = testtime
 		if not starttime or testtime < starttime:
@@ -385,7 +426,7 @@ def info(file, data, args, cb=None):
 	})
 	x = re.match('.*/suspend-[a-z]*-(?P<d>[0-9]*)-(?P<t>[0-9]*)-[0-9]*min/summary.html', file)
 	if x:
-		btime = datetime.strptime(x.group('d')+x.group('t'), '%y%m%d%H%M%S')
+		btime = stamptime(x.group('d'), x.group('t'))
 		data[-1]['timestamp'] = btime
 	for key in extra:
 		data[-1][key] = extra[key]
@@ -757,7 +798,7 @@ def gzipFile(file):
 		return file
 	return out
 
-def formatTestSpreadsheet(id, urlprefix=True):
+def formatTestSpreadsheet(id, urlprefix=True, extra=None):
 	hidx = 6 if urlprefix else 5
 	highlight_range = {
 		'sheetId': 1,
@@ -879,11 +920,15 @@ def formatTestSpreadsheet(id, urlprefix=True):
 	{'autoResizeDimensions': {'dimensions': {'sheetId': 5,
 		'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': 6}}
 	}]
+	# any extra requests (e.g. data writes) go ahead of the formatting
+	if extra:
+		requests = extra + requests
 	body = {
 		'requests': requests
 	}
 	response = google_api_command('formatsheet', id, body)
-	pprint('{0} cells updated.'.format(len(response.get('replies'))));
+	count = len(response.get('replies')) - (len(extra) if extra else 0)
+	pprint('{0} cells updated.'.format(count));
 
 def createTestSpreadsheet(testruns, devall, issues, mybugs, folder, urlhost, title, useturbo, usewifi):
 	pid = gdrive_find(folder)
@@ -980,38 +1025,22 @@ def createTestSpreadsheet(testruns, devall, issues, mybugs, folder, urlhost, tit
 			devdata[type].append(r)
 
 	# assemble the entire spreadsheet into testdata
-	i = 1
-	results = []
+	results, counts = [], Counter()
 	desc = {'summary': op.join(urlhost, 'summary.html')}
-	testdata = [{'values':headrows[0]}]
-	for test in sorted(testruns, key=lambda v:(v['mode'], v['host'], v['kernel'], v['time'])):
+	total = len(testruns)
+	testdata = [None] * (total + 1)
+	testdata[0] = {'values':headrows[0]}
+	for i, test in enumerate(sorted(testruns, key=itemgetter('mode', 'host', 'kernel', 'time')), 1):
 		for key in ['host', 'mode', 'kernel', 'target']:
 			if key in test and key not in desc:
 				desc[key] = test[key]
-		if test['result'] not in desc:
-			results.append(test['result'])
-			desc[test['result']] = 0
-		desc[test['result']] += 1
+		counts[test['result']] += 1
 		url = op.join(urlhost, test['url'])
-		r = {'values':[
-			{'userEnteredValue':{'numberValue':i}},
-			{'userEnteredValue':{'stringValue':test['mode']}},
-			{'userEnteredValue':{'stringValue':test['host']}},
-			{'userEnteredValue':{'stringValue':test['kernel']}},
-			{'userEnteredValue':{'stringValue':test['time']}},
-			{'userEnteredValue':{'stringValue':test['result']}},
-			{'userEnteredValue':{'stringValue':test['issues']}},
-			{'userEnteredValue':{'numberValue':float(test['suspend'])}},
-			{'userEnteredValue':{'numberValue':float(test['resume'])}},
-			{'userEnteredValue':{'stringValue':test['sus_worst']}},
-			{'userEnteredValue':{'numberValue':float(test['sus_worsttime'])}},
-			{'userEnteredValue':{'stringValue':test['res_worst']}},
-			{'userEnteredValue':{'numberValue':float(test['res_worsttime'])}},
-		]}
+		r = {'values':[gsnum(i)] + [cell(test[key]) for key, cell in testcols]}
 		if useturbo:
 			for key in ['pkgpc10', 'syslpi']:
 				val = test[key] if key in test else ''
-				r['values'].append({'userEnteredValue':{'stringValue':val}})
+				r['values'].append(gsstr(val))
 				if key not in desc:
 					results.append(key)
 					desc[key] = -1
@@ -1026,34 +1055,32 @@ def createTestSpreadsheet(testruns, devall, issues, mybugs, folder, urlhost, tit
 			if val.endswith(' ms'):
 				val = '%d' % int(val.split()[0])
 			try:
-				r['values'].append({'userEnteredValue':{'numberValue':int(val)}})
+				r['values'].append(gsnum(int(val)))
 			except:
-				r['values'].append({'userEnteredValue':{'stringValue':val}})
+				r['values'].append(gsstr(val))
 			if 'wifi' not in desc:
 				results.append('wifi')
 				desc['wifi'] = 0
 			if val and val.lower() != 'timeout':
 				desc['wifi'] += 1
 		r['values'].append({'userEnteredValue':{'formulaValue':gslink.format(url, 'html')}})
-		testdata.append(r)
-		i += 1
-	total = i - 1
+		testdata[i] = r
 	desc['total'] = '%d' % total
 	desc['issues'] = '%d' % len(issues)
 	if 'target' not in desc:
 		desc['target'] = 'unknown'
-	fail = 0
 	for key in results:
-		if key not in desc:
-			continue
 		val = desc[key]
-		perc = 100.0*float(val)/float(total)
-		if perc >= 0:
-			desc[key] = '%d (%.1f%%)' % (val, perc)
+		if val >= 0:
+			desc[key] = '%d (%.1f%%)' % (val, 100.0*float(val)/float(total))
 		else:
 			desc[key] = 'disabled'
+	fail = 0
+	for key, val in counts.items():
+		desc[key] = '%d (%.1f%%)' % (val, 100.0*float(val)/float(total))
 		if key.startswith('fail'):
 			fail += val
+	results += list(counts)
 	if fail:
 		perc = 100.0*float(fail)/float(total)
 		desc['fail'] = '%d (%.1f%%)' % (fail, perc)
@@ -1121,9 +1148,10 @@ def createTestSpreadsheet(testruns, devall, issues, mybugs, folder, urlhost, tit
 				]
 			},
 			{
-				'properties': {'sheetId': 1, 'title': 'Test Data'},
+				'properties': {'sheetId': 1, 'title': 'Test Data',
+					'gridProperties': {'rowCount': max(len(testdata), 1000)}},
 				'data': [
-					{'startRow': 0, 'startColumn': 0, 'rowData': testdata}
+					{'startRow': 0, 'startColumn': 0, 'rowData': testdata[:1]}
 				]
 			},
 			{
@@ -1160,11 +1188,21 @@ def createTestSpreadsheet(testruns, devall, issues, mybugs, folder, urlhost, tit
 		return ''
 	id = sheet['spreadsheetId']
 
-	# special formatting
-	formatTestSpreadsheet(id, urlhost)
+	# write the test rows in chunks to keep each request small, each at
+	# a fixed row so a retried request overwrites rather than duplicates
+	chunks = []
+	for i in range(1, len(testdata), 500):
+		chunks.append({'updateCells': {'rows': testdata[i:i+500],
+			'start': {'sheetId': 1, 'rowIndex': i, 'columnIndex': 0},
+			'fields': 'userEnteredValue'}})
+	for req in chunks[:-1]:
+		google_api_command('formatsheet', id, {'requests': [req]})
+
+	# special formatting, sent along with the last chunk of rows
+	formatTestSpreadsheet(id, urlhost, chunks[-1:])
 
 	# move the spreadsheet into its proper folder
-	file = google_api_command('move', id, pid)
+	file = google_api_command('move', id, pid, 'root')
 	pprint('spreadsheet id: %s' % id)
 	if 'spreadsheetUrl' not in sheet:
 		return id
@@ -1574,7 +1612,7 @@ def createSummarySpreadsheet(args, data, deviceinfo, buglist, prefs=''):
 
 	# move the spreadsheet into its proper folder
 	pprint('moving the spreadsheet into its folder')
-	file = google_api_command('move', id, kfid)
+	file = google_api_command('move', id, kfid, 'root')
 	pprint('spreadsheet id: %s' % id)
 	if 'spreadsheetUrl' in sheet:
 		pprint('SUCCESS: spreadsheet created -> %s' % sheet['spreadsheetUrl'])
@@ -1593,31 +1631,62 @@ def multiTestDesc(indir, gettime=False):
 	desc['mode'] = m.group('m')
 	if gettime:
 		try:
-			dt = datetime.strptime(m.group('d')+m.group('t'), '%y%m%d%H%M%S')
+			dt = stamptime(m.group('d'), m.group('t'))
 			desc['time'] = dt.strftime('%Y/%m/%d %H:%M:%S')
 		except:
 			pass
 	return desc
 
+def multitest_dirs(indir):
+	# yield the suspend-* test folders of a multitest in time order
+	with os.scandir(indir) as it:
+		entries = sorted(it, key=lambda e:e.name)
+	for entry in entries:
+		if testdirre.match(entry.name) and entry.is_dir():
+			yield entry.name
+
 def files_from_test(testdir):
-	testfiles = {
-		'html':'.*.html',
-		'dmesg':'.*_dmesg.txt',
-		'ftrace':'.*_ftrace.txt',
-		'result': 'result.txt',
-		'crashlog': 'dmesg-crash.log',
-		'sshlog': 'sshtest.log',
-		'log': 'test.log',
-	}
 	found = dict()
-	for file in os.listdir(testdir):
-		for i in testfiles:
-			if re.match(testfiles[i], file):
-				f = '%s/%s' % (testdir, file)
-				if sg.sysvals.usable(f):
-					found[i] = '%s/%s' % (testdir, file)
+	with os.scandir(testdir) as it:
+		for entry in it:
+			name = entry.name[:-3] if entry.name.endswith('.gz') else entry.name
+			if name in testfilenames:
+				type = testfilenames[name]
+			else:
+				for type, suffix in testfilesuffix:
+					if name.endswith(suffix):
+						break
+				else:
+					continue
+			# the entry caches its stat, skip empty or broken files
+			try:
+				if entry.stat().st_size < 1:
+					continue
+			except OSError:
+				continue
+			found[type] = '%s/%s' % (testdir, entry.name)
 	return found
 
+def scan_testdir(indir, entry):
+	if not testdirre.match(entry.name) or not entry.is_dir():
+		return None
+	found = files_from_test('%s/%s' % (indir, entry.name))
+	netlost = False
+	if 'sshlog' in found or 'log' in found:
+		logfile = found['log'] if 'log' in found else found['sshlog']
+		# only the last line matters, so just read the tail of the log
+		with open(logfile, 'rb') as fp:
+			fp.seek(0, os.SEEK_END)
+			fp.seek(max(0, fp.tell() - 4096))
+			tail = fp.read().strip()
+			if not tail:
+				fp.seek(0)
+				tail = fp.read().strip()
+		last = tail.split(b'\n')[-1]
+		if b'will issue an rtcwake in' in last or b'not responding' in last:
+			netlost = True
+	return (found, netlost)
+
 def data_from_test(files, out, indir, issues):
 	sv = sg.sysvals
 	if 'html' in files:
@@ -1676,18 +1745,26 @@ def pm_graph_report(args, indir, outpath, urlprefix, buglist, htmlonly):
 	idx = total = begin = 0
 
 	pprint('LOADING: %s' % indir)
-	count = len(os.listdir(indir))
+	with os.scandir(indir) as it:
+		dirlist = sorted(it, key=lambda e:e.name)
+	count = len(dirlist)
+	# the folder scans are pure file i/o, so run them in parallel
+	with ThreadPoolExecutor(max_workers=16) as pool:
+		scans = list(pool.map(lambda e:scan_testdir(indir, e), dirlist))
 	# load up all the test data
-	for dir in sorted(os.listdir(indir)):
+	for entry, scan in zip(dirlist, scans):
+		dir = entry.name
 		idx += 1
 		if idx % 10 == 0 or idx == count:
 			sys.stdout.write('\rLoading data... %.0f%%' % (100*idx/count))
 			sys.stdout.flush()
-		if not re.match('suspend-[0-9]*-[0-9]*$', dir) or not op.isdir(indir+'/'+dir):
+		m = testdirre.match(dir)
+		if not scan or not m:
 			continue
+		found, netlost = scan
 		# create default entry for crash
 		total += 1
-		dt = datetime.strptime(dir, 'suspend-%y%m%d-%H%M%S')
+		dt = stamptime(m.group('d'), m.group('t'))
 		if not begin:
 			begin = dt
 		dirtime = dt.strftime('%Y/%m/%d %H:%M:%S')
@@ -1696,7 +1773,6 @@ def pm_graph_report(args, indir, outpath, urlprefix, buglist, htmlonly):
 			'issues': '', 'suspend': 0, 'resume': 0, 'sus_worst': '',
 			'sus_worsttime': 0, 'res_worst': '', 'res_worsttime': 0,
 			'url': dir, 'devlist': dict(), 'sysinfo': '', 'funclist': []}
-		found = files_from_test('%s/%s' % (indir, dir))
 		tdata = data_from_test(found, data, indir, issues)
 		if tdata:
 			data = tdata
@@ -1716,19 +1792,11 @@ def pm_graph_report(args, indir, outpath, urlprefix, buglist, htmlonly):
 			if not urlprefix:
 				data['localfile'] = found['html']
 		else:
-			for key in desc:
-				data[key] = desc[key]
+			data.update(desc)
 		if 'pkgpc10' in data and 'syslpi' in data:
 			useturbo = True
 		if 'wifi' in data:
 			usewifi = True
-		netlost = False
-		if 'sshlog' in found or 'log' in found:
-			logfile = found['log'] if 'log' in found else found['sshlog']
-			fp = open(logfile)
-			last = fp.read().strip().split('\n')[-1]
-			if 'will issue an rtcwake in' in last or 'not responding' in last:
-				netlost = True
 		if netlost:
 			data['issues'] = 'NETLOST' if not data['issues'] else 'NETLOST '+data['issues']
 		if netlost and 'html' in found:
@@ -1974,7 +2042,7 @@ def find_multitests(args, usecache=True):
 	pprint('searching folder for multitest data')
 	for dirname, dirnames, filenames in os.walk(folder, followlinks=True):
 		for dir in dirnames:
-			if re.match('suspend-[0-9]*-[0-9]*$', dir):
+			if testdirre.match(dir):
 				r = op.relpath(dirname, folder)
 				if urlprefix:
 					urlp = urlprefix if r == '.' else op.join(urlprefix, r)
@@ -2164,9 +2232,8 @@ def categorize_by_timeline(args, multitests, verbose=False):
 			continue
 		desc = multiTestDesc(indir, True)
 		data, html = False, ''
-		for dir in sorted(os.listdir(indir)):
-			if not re.match('suspend-[0-9]*-[0-9]*$', dir) or not op.isdir(indir+'/'+dir):
-				continue
+		# stop at the first test with data, the rest are never checked
+		for dir in multitest_dirs(indir):
 			found = files_from_test('%s/%s' % (indir, dir))
 			data = data_from_test(found, dict(), indir, [])
 			if data:
@@ -8,9 +8,10 @@ import sys
 import re
 import shutil
 import time
-from subprocess import call, Popen, PIPE
+from subprocess import call, run, Popen, PIPE, DEVNULL
 from datetime import date, datetime, timedelta
-from tempfile import mkdtemp
+from tempfile import mkdtemp, NamedTemporaryFile
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import os.path as op
 from lib.parallel import AsyncProcess, MultiProcess, findProcess
@@ -37,23 +38,34 @@ def ascii(text):
 
 def doError(msg, machine=None):
 	if machine:
+		machine.sshmaster_stop()
 		machine.release_machine()
 	pprint('ERROR: %s\n' % msg)
 	sys.exit(1)
 
-def runcmd(cmd, output=False, fatal=True):
+def runcmd(cmd, output=False, fatal=True, env=None):
 	out = []
-	p = Popen(cmd.split(), stderr=PIPE, stdout=PIPE)
-	for line in p.stdout:
-		line = ascii(line).strip()
-		if output:
+	# stderr is unused, so don't leave it on a pipe that can fill up
+	if output:
+		p = Popen(cmd.split(), stderr=DEVNULL, stdout=PIPE, env=env)
+		for line in p.stdout:
+			line = ascii(line).strip()
 			pprint(line)
-		out.append(line)
-	if fatal and p.poll():
+			out.append(line)
+		res = p.wait()
+	else:
+		# nothing to echo, so take the output in one read
+		p = run(cmd.split(), stderr=DEVNULL, stdout=PIPE, env=env)
+		text = ascii(p.stdout)
+		out = [line.strip() for line in text.split('\n')]
+		if not text or text.endswith('\n'):
+			out.pop()
+		res = p.returncode
+	if fatal and res:
 		doError(cmd)
 	return out
 
-def kernelmatch(kmatch, pkgfmt, pkgname):
+def kernelmatch(kmatch, pkgfmt, pkgname, kre=None):
 	# verify this is a kernel package and pull out the version
 	if pkgname.startswith('linux-headers-'):
 		kver = pkgname[14:]
@@ -64,7 +76,11 @@ def kernelmatch(kmatch, pkgfmt, pkgname):
 			kver = pkgname[12:]
 	else:
 		return False
-	if kmatch == pkgname or kmatch == kver or re.match(kmatch, kver):
+	if kmatch == pkgname or kmatch == kver:
+		return True
+	if not kre:
+		kre = re.compile(kmatch)
+	if kre.match(kver):
 		return True
 	return False
 
@@ -76,7 +92,7 @@ def kernelBuild(args):
 		repo = 'http://git.kernel.org/pub/scm/linux/kernel/git/torvalds/linux.git'
 		args.ksrc = mkdtemp(prefix='linux')
 		pprint('Cloning new kernel source tree ...')
-		call('git clone %s %s' % (repo, args.ksrc), shell=True)
+		call(['git', 'clone', repo, args.ksrc])
 		cloned = True
 	# set the repo to the right tag
 	isgit = op.exists(op.join(args.ksrc, '.git/config'))
@@ -90,15 +106,16 @@ def kernelBuild(args):
 			args.ktag = runcmd('git -C %s describe --abbrev=0 --tags' % args.ksrc)[0]
 			pprint('Latest RC is %s' % args.ktag)
 		elif args.ktag != 'master':
-			tags = runcmd('git -C %s tag' % args.ksrc)
-			if args.ktag not in tags:
+			tag = runcmd('git -C %s rev-parse --verify --quiet refs/tags/%s' % \
+				(args.ksrc, args.ktag), False, False)
+			if not tag:
 				doError('%s is not a valid tag' % args.ktag)
 		runcmd('git -C %s checkout %s' % (args.ksrc, args.ktag), True)
 
 	# apply kernel patches
 	kconfig = ''
 	if args.kcfg:
-		if not op.exists(args.kcfg) or not op.isdir(args.kcfg):
+		if not op.isdir(args.kcfg):
 			doError('%s is not an existing folder' % args.kcfg)
 		patches = []
 		for file in sorted(os.listdir(args.kcfg)):
@@ -116,40 +133,45 @@ def kernelBuild(args):
 
 	# build the kernel
 	runcmd('cp %s %s' % (kconfig, op.join(args.ksrc, '.config')), True)
-	try:
-		numcpu = int(runcmd('getconf _NPROCESSORS_ONLN', False, False)[0])
-	except:
-		numcpu = 1
-	runcmd('make -C %s distclean' % args.ksrc, True)
+	numcpu = os.cpu_count() or 1
+	# use the ccache compiler wrappers when installed, rebuilds get cheap,
+	# only the make calls see the change so our own PATH stays as it was
+	env, path = None, os.environ.get('PATH', '').split(':')
+	ccdirs = ['/usr/lib/ccache', '/usr/lib64/ccache']
+	if not any(d in path for d in ccdirs):
+		for ccdir in ccdirs:
+			if op.isdir(ccdir):
+				env = dict(os.environ, PATH=':'.join([ccdir] + path))
+				break
+	runcmd('make -C %s distclean' % args.ksrc, True, env=env)
 	runcmd('cp %s %s' % (kconfig, op.join(args.ksrc, '.config')), True)
-	runcmd('make -C %s olddefconfig' % args.ksrc, True)
-	kver = runcmd('make -s -C %s kernelrelease' % args.ksrc)[0]
+	runcmd('make -C %s olddefconfig' % args.ksrc, True, env=env)
+	kver = runcmd('make -s -C %s kernelrelease' % args.ksrc, env=env)[0]
 	if args.kname:
 		runcmd('make -C %s -j %d %s-pkg LOCALVERSION=-%s' % \
-			(args.ksrc, numcpu, args.pkgfmt, args.kname), True)
+			(args.ksrc, numcpu, args.pkgfmt, args.kname), True, env=env)
 	else:
 		runcmd('make -C %s -j %d %s-pkg' % \
-			(args.ksrc, numcpu, args.pkgfmt), True)
+			(args.ksrc, numcpu, args.pkgfmt), True, env=env)
 
 	# build turbostat
 	tdir = op.join(args.ksrc, 'tools/power/x86/turbostat')
 	if op.isdir(tdir):
-		call('make -C %s clean' % tdir, shell=True)
-		call('make -C %s turbostat' % tdir, shell=True)
+		call(['make', '-C', tdir, 'clean'], env=env)
+		call(['make', '-C', tdir, 'turbostat'], env=env)
 
 	# find the output files
 	miscfiles, packages, out = [], [], []
 	outdir = os.path.realpath(os.path.join(args.ksrc, '..'))
-	for file in os.listdir(outdir):
-		if kver not in file:
-			continue
-		created = os.path.getctime(op.join(outdir, file))
-		if created < mystarttime:
-			continue
-		if file.endswith(args.pkgfmt):
-			packages.append(file)
-		else:
-			miscfiles.append(file)
+	with os.scandir(outdir) as it:
+		for entry in it:
+			file = entry.name
+			if kver not in file or entry.stat().st_ctime < mystarttime:
+				continue
+			if file.endswith(args.pkgfmt):
+				packages.append(file)
+			else:
+				miscfiles.append(file)
 	for file in miscfiles:
 		os.remove(os.path.join(outdir, file))
 	if cloned:
@@ -158,8 +180,7 @@ def kernelBuild(args):
 
 	# move the output files to the output folder
 	if args.pkgout:
-		if not op.exists(args.pkgout):
-			os.makedirs(args.pkgout)
+		os.makedirs(args.pkgout, exist_ok=True)
 		if outdir != os.path.realpath(args.pkgout):
 			for file in packages:
 				tgt = os.path.join(args.pkgout, file)
@@ -185,7 +206,9 @@ def kernelInstall(args, m):
 
 	# get the kernel packages for our version
 	packages = []
-	for file in sorted(os.listdir(args.pkgout)):
+	with os.scandir(args.pkgout) as it:
+		files = sorted(entry.name for entry in it if entry.is_file())
+	for file in files:
 		if not file.startswith('linux-') or not file.endswith('.deb'):
 			continue
 		if args.kernel in file:
@@ -198,96 +221,92 @@ def kernelInstall(args, m):
 	res = m.checkhost(args.userinput)
 	if res:
 		doError('%s: %s' % (m.host, res), m)
-	pprint('os check')
-	res = m.oscheck()
-	if args.pkgfmt == 'deb' and res != 'ubuntu':
-		doError('%s: needs ubuntu to use deb packages' % m.host, m)
-	elif args.pkgfmt == 'rpm' and res != 'fedora':
-		doError('%s: needs fedora to use rpm packages' % m.host, m)
-
-	# configure the system
-	pprint('boot setup')
-	m.bootsetup()
-	pprint('wifi setup')
-	out = m.wifisetup(True)
-	if out:
-		pprint('WIFI DEVICE NAME: %s' % m.wdev)
-		pprint('WIFI MAC ADDRESS: %s' % m.wmac)
-		pprint('WIFI ESSID      : %s' % m.wap)
-		pprint('WIFI IP ADDRESS : %s' % m.wip)
+	m.sshmaster()
+	try:
+		pprint('os check')
+		res = m.oscheck()
+		if args.pkgfmt == 'deb' and res != 'ubuntu':
+			doError('%s: needs ubuntu to use deb packages' % m.host, m)
+		elif args.pkgfmt == 'rpm' and res != 'fedora':
+			doError('%s: needs fedora to use rpm packages' % m.host, m)
+
+		# configure the system
+		pprint('boot setup')
+		m.bootsetup()
+		pprint('wifi setup')
+		out = m.wifisetup(True)
+		if out:
+			pprint('WIFI DEVICE NAME: %s' % m.wdev)
+			pprint('WIFI MAC ADDRESS: %s' % m.wmac)
+			pprint('WIFI ESSID      : %s' % m.wap)
+			pprint('WIFI IP ADDRESS : %s' % m.wip)
+			printlines(out)
+		pprint('configure grub')
+		out = m.configure_grub()
 		printlines(out)
-	pprint('configure grub')
-	out = m.configure_grub()
-	printlines(out)
-
-	# remove unneeeded space
-	pprint('remove previous test data')
-	printlines(m.sshcmd('rm -r pm-graph-test ; mkdir pm-graph-test', 10))
-	if args.rmkernel:
-		pprint('remove old kernels')
-		kernelUninstall(args, m)
-
-	# install tools
-	pprint('install mcelog')
-	out = m.install_mcelog(args.proxy)
-	printlines(out)
-	pprint('install sleepgraph')
-	out = m.install_sleepgraph(args.proxy)
-	printlines(out)
-	out = m.sshcmd('grep submitOptions /usr/lib/pm-graph/sleepgraph.py', 10).strip()
-	if out:
-		doError('%s: sleepgraph installed with "submit" branch' % m.host, m)
-	if args.ksrc:
-		pprint('install turbostat')
-		tfile = op.join(args.ksrc, 'tools/power/x86/turbostat/turbostat')
-		if op.exists(tfile):
-			m.scpfile(tfile, '/tmp')
-			printlines(m.sshcmd('sudo cp /tmp/turbostat /usr/bin/', 10))
-		else:
-			pprint('WARNING: turbostat did not build')
-
-	# install the kernel
-	pprint('checking kernel versions')
-	if not m.list_kernels(True):
-		doError('%s: could not list installed kernel versions' % m.host, m)
-	pprint('uploading kernel packages')
-	pkglist = ''
-	for pkg in packages:
-		rp = op.join('/tmp', pkg)
-		if not pkglist:
-			pkglist = rp
-		else:
-			pkglist += ' %s' % rp
-		m.scpfile(op.join(args.pkgout, pkg), '/tmp')
-	pprint('installing the kernel')
-	out = m.sshcmd('sudo dpkg -i %s' % pkglist, 600)
-	printlines(out)
-	idx = m.kernel_index(args.kernel)
-	if idx < 0:
-		doError('%s: %s failed to install' % (m.host, args.kernel), m)
-	pprint('kernel install completed')
-	out = m.sshcmd('sudo grub-set-default \'1>%d\'' % idx, 30)
-	printlines(out)
-
-	# system status
-	pprint('sleepgraph modes')
-	printlines(m.sshcmd('sleepgraph -modes', 10))
-	pprint('disk space available')
-	printlines(m.sshcmd('df /', 10))
+
+		# remove unneeeded space
+		pprint('remove previous test data')
+		printlines(m.sshcmd('rm -r pm-graph-test ; mkdir pm-graph-test', 10))
+		if args.rmkernel:
+			pprint('remove old kernels')
+			kernelUninstall(args, m)
+
+		# install tools
+		pprint('install mcelog')
+		out = m.install_mcelog(args.proxy)
+		printlines(out)
+		pprint('install sleepgraph')
+		out = m.install_sleepgraph(args.proxy)
+		printlines(out)
+		out = m.sshcmd('grep submitOptions /usr/lib/pm-graph/sleepgraph.py', 10).strip()
+		if out:
+			doError('%s: sleepgraph installed with "submit" branch' % m.host, m)
+		if args.ksrc:
+			pprint('install turbostat')
+			tfile = op.join(args.ksrc, 'tools/power/x86/turbostat/turbostat')
+			if op.exists(tfile):
+				m.scpfile(tfile, '/tmp')
+				printlines(m.sshcmd('sudo cp /tmp/turbostat /usr/bin/', 10))
+			else:
+				pprint('WARNING: turbostat did not build')
+
+		# install the kernel
+		pprint('checking kernel versions')
+		if not m.list_kernels(True):
+			doError('%s: could not list installed kernel versions' % m.host, m)
+		pprint('uploading kernel packages')
+		pkglist = ' '.join(op.join('/tmp', pkg) for pkg in packages)
+		m.scpfiles([op.join(args.pkgout, pkg) for pkg in packages], '/tmp')
+		pprint('installing the kernel')
+		out = m.sshcmd('sudo dpkg -i %s' % pkglist, 600)
+		printlines(out)
+		idx = m.kernel_index(args.kernel)
+		if idx < 0:
+			doError('%s: %s failed to install' % (m.host, args.kernel), m)
+		pprint('kernel install completed')
+		out = m.sshcmd('sudo grub-set-default \'1>%d\'' % idx, 30)
+		printlines(out)
+
+		# system status
+		pprint('sleepgraph modes / disk space available')
+		printlines(m.sshcmd('sleepgraph -modes ; df /', 20))
+	finally:
+		m.sshmaster_stop()
 
 def kernelUninstall(args, m):
 	if not (args.pkgfmt and args.user and args.host and \
 		args.addr and args.rmkernel):
 		doError('kernel uninstall is missing arguments', m)
 	try:
-		re.match(args.rmkernel, '')
+		kre = re.compile(args.rmkernel)
 	except:
 		doError('kernel regex caused an exception: "%s"' % args.rmkernel, m)
 	packages = []
 	res = m.sshcmd('dpkg -l', 30)
 	for line in res.split('\n'):
 		v = line.split()
-		if len(v) > 2 and kernelmatch(args.rmkernel, args.pkgfmt, v[1]):
+		if len(v) > 2 and kernelmatch(args.rmkernel, args.pkgfmt, v[1], kre):
 			packages.append(v[1])
 	for p in packages:
 		pprint('removing %s ...' % p)
@@ -334,8 +353,7 @@ def pm_graph(args, m):
 	if args.testout:
 		hostout = op.join(args.testout, hostout)
 	localout = op.join(hostout, basedir)
-	if not op.exists(localout):
-		os.makedirs(localout)
+	os.makedirs(localout, exist_ok=True)
 	pprint('Output folder: %s' % localout)
 
 	# prepare the system for testing
@@ -373,8 +391,7 @@ def pm_graph(args, m):
 		testdir = datetime.now().strftime('suspend-%y%m%d-%H%M%S')
 		testout = '%s/%s' % (localout, testdir)
 		testout_ssh = '%s/%s' % (sshout, testdir)
-		if not op.exists(testout):
-			os.makedirs(testout)
+		os.makedirs(testout, exist_ok=True)
 		rtcwake = '90' if basemode == 'disk' else '15'
 		cmdfmt = 'mkdir {0}; sudo sleepgraph -dev -sync -wifi -display on '\
 			'-gzip -m {1} -rtcwake {2} -result {0}/result.txt -o {0} -info %s '\
@@ -492,8 +509,7 @@ def spawnStressTest(args):
 		cmd += ' -count %d' % args.count
 	if args.duration:
 		cmd += ' -duration %d' % args.duration
-	if not op.exists(hostout):
-		os.makedirs(hostout)
+	os.makedirs(hostout, exist_ok=True)
 	call('%s run >> %s/runstress.log 2>&1 &' % (cmd, hostout), shell=True)
 
 def spawnMachineCmds(args, machlist, command):
@@ -518,18 +534,20 @@ def spawnMachineCmds(args, machlist, command):
 		cmdfmt += ' -reservecmd "%s"' % args.reservecmd
 	if args.releasecmd:
 		cmdfmt += ' -releasecmd "%s"' % args.releasecmd
-	cmdsuffix = ' -user {0} -host {1} -addr {2} %s' % command
 
+	cmdhost = dict()
 	for host in machlist:
 		m = machlist[host]
-		cmds.append(cmdfmt+cmdsuffix.format(m.user, m.host, m.addr))
+		cmd = '%s -user %s -host %s -addr %s %s' % \
+			(cmdfmt, m.user, m.host, m.addr, command)
+		cmds.append(cmd)
+		cmdhost[cmd] = m.host
 
 	pprint('%sing on %d hosts ...' % (command, len(machlist)))
 	mp = MultiProcess(cmds, 1800)
 	mp.run(8, True)
 	for acmd in mp.complete:
-		m = re.match('.* -host (?P<h>\S*) .*', acmd.cmd)
-		host = m.group('h')
+		host = cmdhost[acmd.cmd]
 		fp = open('/tmp/%s.log' % host, 'w')
 		fp.write(acmd.output)
 		fp.close()
@@ -544,7 +562,22 @@ def spawnMachineCmds(args, machlist, command):
 				m.sshcmd('sudo reboot', 30)
 			m.status = True
 
-def runStressCmd(args, cmd, mlist=None):
+def parseMachineLine(line):
+	if line.startswith('#') or not line.strip():
+		return None
+	f = line.split()
+	if len(f) < 3 or len(f) > 4:
+		return None
+	flag = f[-4] if len(f) == 4 else ''
+	return (flag, f[-1], f[-3], f[-2])
+
+def probeMachine(machine, cmd, userinput):
+	res = machine.checkhost(userinput)
+	if res or cmd != 'ready':
+		return (res, '')
+	return (res, machine.kernel_version())
+
+def machineFile(args):
 	if args.kernel:
 		file = '%s/machine-%s.txt' % (op.dirname(args.machines), args.kernel)
 		if not op.exists(file):
@@ -552,22 +585,43 @@ def runStressCmd(args, cmd, mlist=None):
 			pprint('LOG CREATED: %s' % file)
 	else:
 		file = args.machines
-	changed, machlist, out, fp = False, dict(), [], open(file)
-
-	for line in fp.read().split('\n'):
+	with open(file) as fp:
+		lines = fp.read().splitlines()
+	return (file, lines)
+
+def runStressCmd(args, cmd, mlist=None, mfile=None):
+	# mfile lets a caller hand in a machine file it has already read
+	file, lines = mfile if mfile else machineFile(args)
+	changed, machlist, out = False, dict(), []
+
+	# the online/ready checks are all ssh latency, so probe hosts in parallel
+	probes = dict()
+	if cmd in ['online', 'ready'] and not args.userinput:
+		todo = []
+		for line in lines:
+			v = parseMachineLine(line)
+			if not v:
+				continue
+			flag, user, host, addr = v
+			if (cmd == 'online' and not flag) or \
+				(cmd == 'ready' and flag in ['O', 'I']):
+				todo.append(RemoteMachine(user, host, addr))
+		with ThreadPoolExecutor(max_workers=32) as pool:
+			res = pool.map(lambda m:probeMachine(m, cmd, False), todo)
+			for m, r in zip(todo, res):
+				probes[m.host] = r
+	filter = cmd[5:].split(',') if cmd.startswith('find:') else []
+
+	for line in lines:
 		out.append(line)
-		if line.startswith('#') or not line.strip():
+		v = parseMachineLine(line)
+		if not v:
 			continue
-		f = line.split()
-		if len(f) < 3 or len(f) > 4:
-			continue
-		user, host, addr = f[-1], f[-3], f[-2]
-		flag = f[-4] if len(f) == 4 else ''
+		flag, user, host, addr = v
 		machine = RemoteMachine(user, host, addr,
 			args.resetcmd, args.reservecmd, args.releasecmd)
 		# FIND - get machines by flag(s)
 		if cmd.startswith('find:'):
-			filter = cmd[5:].split(',')
 			if flag not in filter:
 				continue
 			machlist[host] = machine
@@ -575,7 +629,10 @@ def runStressCmd(args, cmd, mlist=None):
 		elif cmd == 'online':
 			if flag:
 				continue
-			res = machine.checkhost(args.userinput)
+			if host in probes:
+				res = probes[host][0]
+			else:
+				res = machine.checkhost(args.userinput)
 			if res:
 				pprint('%30s: %s' % (host, res))
 				machlist[host] = machine
@@ -599,11 +656,13 @@ def runStressCmd(args, cmd, mlist=None):
 		elif cmd == 'ready':
 			if flag != 'O' and flag != 'I':
 				continue
-			res = machine.checkhost(args.userinput)
+			if host in probes:
+				res, kver = probes[host]
+			else:
+				res, kver = probeMachine(machine, cmd, args.userinput)
 			if res:
 				pprint('%30s: %s' % (host, res))
 				continue
-			kver = machine.kernel_version()
 			if args.kernel != kver:
 				pprint('%30s: wrong kernel (actual=%s)' % (host, kver))
 				continue
@@ -629,19 +688,22 @@ def runStressCmd(args, cmd, mlist=None):
 				log = op.join(args.testout, log)
 			print('\n[%s]\n' % host)
 			if op.exists(log):
-				call('tail -20 %s' % log, shell=True)
+				call(['tail', '-20', log])
 		# REBOOT - look at O+ machines
 		elif cmd == 'reboot':
 			if flag != 'O' and flag != 'I' and flag != 'R':
 				continue
 			machine.reboot(args.kernel)
-	fp.close()
 	if changed:
+		# write a new copy and rename it over the old one atomically
 		pprint('LOGGING AT: %s' % file)
-		fp = open(file, 'w')
-		for line in out[:-1]:
-			fp.write(line.strip()+'\n')
-		fp.close()
+		# the temp name is unique per process, and replacing the real path
+		# keeps a symlinked machines file a symlink
+		real = op.realpath(file)
+		with NamedTemporaryFile('w', dir=op.dirname(real), delete=False) as fp:
+			fp.write(''.join(line.strip()+'\n' for line in out))
+		shutil.copymode(real, fp.name)
+		os.replace(fp.name, real)
 	return machlist
 
 if __name__ == '__main__':
@@ -798,10 +860,11 @@ if __name__ == '__main__':
 				print(h)
 	elif cmd in ['install', 'uninstall']:
 		filter = 'find:O' if cmd == 'install' else 'find:O,I,R'
-		machlist = runStressCmd(args, filter)
+		mfile = machineFile(args)
+		machlist = runStressCmd(args, filter, mfile=mfile)
 		spawnMachineCmds(args, machlist, cmd)
 		if cmd == 'install':
-			runStressCmd(args, cmd, machlist)
+			runStressCmd(args, cmd, machlist, mfile)
 	elif cmd == 'ready':
 		if not args.kernel:
 			doError('%s command requires kernel' % args.command)
@@ -3,7 +3,6 @@
 import sys
 import time
 import os
-import string
 import re
 from datetime import datetime
 import base64
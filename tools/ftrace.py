@@ -23,7 +23,6 @@
 import sys
 import time
 import os
-import string
 import re
 import array
 import platform
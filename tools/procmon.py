@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import sys
 import time
-import string
 from subprocess import call, Popen, PIPE
 
 if __name__ == '__main__':